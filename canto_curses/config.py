@@ -24,11 +24,12 @@ from canto_next.remote import assign_to_dict, access_dict
 from .locks import config_lock
 from .subthread import SubThread
 
-from threading import Thread, Event, current_thread
+from threading import Thread, Event
 import traceback
 import logging
 import curses   # Colors
 import json
+import time
 import re
 
 log = logging.getLogger("CONFIG")
@@ -48,8 +49,9 @@ eval_settings = [\
     ".*\\.window\\.(maxwidth|maxheight|float)",
     "color\\..*", "tag.(enumerated|collapsed|extra_tags)",
     "reader.(enumerate_links|show_description|show_enclosures)",
-    "taglist.(spacing|border|wrap|tags_enumerated|tags_enumerated_absolute|hide_empty_tags|search_attributes)",
+    "taglist.(spacing|border|wrap|tags_enumerated|tags_enumerated_absolute|hide_empty_tags|search_attributes|render_cache|read_ahead|attribute_cache)",
     "taglist.cursor.edge",
+    "main.(max_fps|sync_budget)",
     "story.(format_attrs|enumerated)"
 ]
 
@@ -70,6 +72,56 @@ story_needed_attrs = [ "title" ]
 
 CURRENT_CONFIG_VERSION = 1
 
+# How long (in seconds) to wait for each phase of the startup handshake before
+# giving up on the daemon. This can't be a config option, it bounds how long we
+# wait for the config.
+
+HANDSHAKE_TIMEOUT = 30
+
+# A ConfigSnapshot is an immutable view of the configuration at a given
+# generation. prot_configs and friends never modify the dicts contained in a
+# published snapshot, they build new ones and publish a new snapshot, so
+# readers can grab config.snapshot and use it without locking or copying.
+
+class ConfigSnapshot(object):
+    def __init__(self, generation, config, tag_config, daemon_defaults,\
+            daemon_feedconf):
+        self.generation = generation
+        self.config = config
+        self.tag_config = tag_config
+        self.daemon_defaults = daemon_defaults
+        self.daemon_feedconf = daemon_feedconf
+
+# A ConfigOption is a precompiled handle to a single dotted option (i.e.
+# "story.enumerated"). Handles are registered with config.option() and their
+# value is only re-read when a change set touches their subtree, so calling one
+# is just an attribute access.
+
+class ConfigOption(object):
+    def __init__(self, option):
+        self.option = option
+        self.path = option.split(".")
+        self.value = None
+
+    def __call__(self):
+        return self.value
+
+    def affected_by(self, changes):
+        for key in self.path:
+            # A whole section / value was replaced above us.
+            if type(changes) != dict:
+                return True
+            if key not in changes:
+                return False
+            changes = changes[key]
+        return True
+
+    def refresh(self, snapshot):
+        valid, value = access_dict(snapshot.config, self.option)
+        if not valid:
+            value = None
+        self.value = value
+
 class CantoCursesConfig(SubThread):
 
     # The object init just sets up the default settings, doesn't
@@ -145,6 +197,9 @@ class CantoCursesConfig(SubThread):
                 "border" : self.validate_bool,
                 "wrap" : self.validate_bool,
                 "spacing" : self.validate_uint,
+                "render_cache" : self.validate_uint,
+                "read_ahead" : self.validate_uint,
+                "attribute_cache" : self.validate_uint,
             },
 
             "story" :
@@ -166,7 +221,12 @@ class CantoCursesConfig(SubThread):
                 "key" : self.validate_key,
             },
 
-            "main" : { "key" : self.validate_key },
+            "main" :
+            {
+                "key" : self.validate_key,
+                "max_fps" : self.validate_uint,
+                "sync_budget" : self.validate_uint,
+            },
 
             "screen" : { "key" : self.validate_key },
 
@@ -250,6 +310,9 @@ class CantoCursesConfig(SubThread):
                 "border" : False,
                 "wrap" : True,
                 "spacing" : 0,
+                "render_cache" : 4096,
+                "read_ahead" : 50,
+                "attribute_cache" : 16384,
                 "search_attributes" : [ "title" ],
 
                 "key" :
@@ -356,6 +419,9 @@ class CantoCursesConfig(SubThread):
 
             "main" :
             {
+                "max_fps" : 30,
+                "sync_budget" : 10,
+
                 "key" :
                 {
                     ":" : "command",
@@ -435,42 +501,86 @@ class CantoCursesConfig(SubThread):
         self.daemon_defaults = {}
         self.daemon_feedconf = []
 
+        self.generation = 0
+        self.publish()
+
+        self.options = {}
+        self.option_refreshes = 0
+
         self.initd = False
 
-    def init(self, backend, compatible_version):
+        self.version = None
+        self.handshake_state = "disconnected"
+        self.got_version = Event()
+        self.got_configs = Event()
+
+        # Defaults changes we've written but the daemon hasn't echoed back.
+        self.pending_defaults = {}
+
+    # The startup handshake is a simple state machine. All of the initial
+    # requests are sent in one pipelined batch, then we block on an Event for
+    # each response we need before the interface can start:
+    #
+    # disconnected -> requesting -> version -> configs -> ready
+    #
+    # Failure leaves the state as "incompatible" or "timeout".
+
+    def init(self, backend, compatible_version, timeout=HANDSHAKE_TIMEOUT):
         self.vars["location"] = backend.location_args
 
+        timings = []
+        phase_start = time.monotonic()
+
         SubThread.init(self, backend)
 
         self.start_pthread()
 
-        self.version = None
-        self.processed = Event()
-        self.processed.clear()
+        self.handshake_state = "requesting"
+
+        for cmd, args in [ ("VERSION", []), ("WATCHNEWTAGS", []),
+                ("WATCHDELTAGS", []), ("LISTTAGS", ""), ("WATCHCONFIGS", ""),
+                ("CONFIGS", []) ]:
+            self.write(cmd, args)
 
-        self.write("VERSION", [])
-        self.write("WATCHNEWTAGS", [])
-        self.write("WATCHDELTAGS", [])
-        self.write("LISTTAGS", "")
-        self.write("WATCHCONFIGS", "")
-        self.write("CONFIGS", [])
+        now = time.monotonic()
+        timings.append(("connect + requests", now - phase_start))
+        phase_start = now
 
-        # Spin, may want to convert this into an event, but for now it
-        # takes virtually no time and makes it so that we don't have to 
-        # check if we're init'd before using *_opt functions.
+        self.handshake_state = "version"
+
+        if not self.got_version.wait(timeout):
+            log.error("Timed out waiting for daemon version")
+            self.handshake_state = "timeout"
+            self.alive = False
+            return False
 
-        while (not self.version):
-            pass
+        now = time.monotonic()
+        timings.append(("version", now - phase_start))
+        phase_start = now
 
         if self.version != compatible_version:
+            self.handshake_state = "incompatible"
             self.alive = False # Let the subthread die
             return False
 
-        while(not self.initd):
-            pass
+        self.handshake_state = "configs"
+
+        if not self.got_configs.wait(timeout):
+            log.error("Timed out waiting for daemon configuration")
+            self.handshake_state = "timeout"
+            self.alive = False
+            return False
 
         self.eval_tags()
 
+        now = time.monotonic()
+        timings.append(("configs", now - phase_start))
+
+        self.handshake_state = "ready"
+
+        log.info("Handshake complete: %s", ", ".join(\
+                [ "%s %.1fms" % (name, t * 1000) for (name, t) in timings ]))
+
         return True
 
     def validate_uint(self, val, d):
@@ -504,6 +614,8 @@ class CantoCursesConfig(SubThread):
         if type(val) != list:
             return (False, False)
 
+        val = val[:]
+
         # Strip items no longer relevant
         for item in val[:]:
             if item not in self.vars["strtags"]:
@@ -765,11 +877,12 @@ class CantoCursesConfig(SubThread):
         changes = {}
         deletions = {}
 
-        # Sub in non-existent values:
+        # Sub in non-existent values. These are copied because d is part of
+        # the published snapshot and validation may modify c in place.
 
         for key in list(v.keys()):
             if key not in c:
-                c[key] = d[key]
+                c[key] = eval(repr(d[key]), {}, {})
 
         # Validate existing values.
 
@@ -833,25 +946,22 @@ class CantoCursesConfig(SubThread):
     @write_lock(config_lock)
     def prot_listtags(self, tags):
         self.vars["strtags"] = tags
-        self.config["tagorder"] = tags
+
+        c = self.config.copy()
+        c["tagorder"] = tags
+        self.config = c
+        self.publish()
+        self.refresh_options({ "tagorder" : tags })
 
     def prot_version(self, version):
         self.version = version
-
-    def prot_pong(self, empty):
-        self.processed.set()
-
-    def wait_write(self, cmd, args):
-        self.write(cmd, args)
-        if current_thread() != self.prot_thread:
-            self.write("PING", [])
-            self.processed.wait()
-            self.processed.clear()
+        self.got_version.set()
 
     # configs accepts any changes, calls the opt_change hooks and if write is
     # set, sends those changes to the daemon. It's called both when receving
     # CONFIGS from the daemon and when we change opts internally (thus the
-    # write flag).
+    # write flag). Writes go out in order on our connection, so the daemon
+    # has any change before anything we send after it, and we don't wait.
 
     # Note that changes are the only ones propagated through hooks because they
     # are a superset of deletions (i.e. a deletion counts as a change).
@@ -863,19 +973,22 @@ class CantoCursesConfig(SubThread):
             for tag in list(given["tags"].keys()):
                 ntc = given["tags"][tag]
 
-                tc = self.get_tag_conf(tag)
+                tc = self._tag_conf(self.snapshot, tag)
 
                 changes, deletions =\
                         self.validate_config(ntc, tc, self.tag_validators)
 
                 if write:
                     if changes:
-                        self.wait_write("SETCONFIGS", { "tags" : { tag : changes }})
+                        self.write("SETCONFIGS", { "tags" : { tag : changes }})
                     if deletions:
-                        self.wait_write("DELCONFIGS", { "tags" : { tag : deletions }})
+                        self.write("DELCONFIGS", { "tags" : { tag : deletions }})
 
                 if changes:
-                    self.tag_config[tag] = ntc
+                    tag_config = self.tag_config.copy()
+                    tag_config[tag] = ntc
+                    self.tag_config = tag_config
+                    self.publish()
                     call_hook("curses_tag_opt_change", [ { tag : changes } ])
 
         if "CantoCurses" in given:
@@ -901,13 +1014,15 @@ class CantoCursesConfig(SubThread):
 
             if write:
                 if changes:
-                    self.wait_write("SETCONFIGS", { "CantoCurses" : changes })
+                    self.write("SETCONFIGS", { "CantoCurses" : changes })
 
                 if deletions:
-                    self.wait_write("DELCONFIGS", { "CantoCurses" : deletions })
+                    self.write("DELCONFIGS", { "CantoCurses" : deletions })
 
             if changes:
                 self.config = new_config
+                self.publish()
+                self.refresh_options(changes)
                 call_hook("curses_opt_change", [ changes ])
                 if "tags" in changes:
                     self.eval_tags()
@@ -923,22 +1038,39 @@ class CantoCursesConfig(SubThread):
                 else:
                     changes[key] = given["defaults"][key]
 
-            self.daemon_defaults.update(changes)
+            defaults = self.daemon_defaults.copy()
+            defaults.update(changes)
+            self.daemon_defaults = defaults
+            self.publish()
+
+            # Our defaults take effect right away, but TagUpdater acts on
+            # defaults changes over the tag connection, which isn't ordered
+            # against ours. So we ask for the defaults back and hold the hook
+            # until they arrive, when the daemon has certainly applied them.
 
             if write:
-                self.wait_write("SETCONFIGS", { "defaults" : self.daemon_defaults })
+                self.write("SETCONFIGS", { "defaults" : self.daemon_defaults })
+                self.write("CONFIGS", [ "defaults" ])
+                self.pending_defaults.update(changes)
+            else:
+                pending = self.pending_defaults
+                self.pending_defaults = {}
+                pending.update(changes)
 
-            call_hook("curses_def_opt_change", [ changes ])
+                call_hook("curses_def_opt_change", [ pending ])
 
         if "feeds" in given:
 
             self.daemon_feedconf = given["feeds"]
+            self.publish()
+
             if write:
-                self.wait_write("SETCONFIGS", { "feeds" : self.daemon_feedconf })
+                self.write("SETCONFIGS", { "feeds" : self.daemon_feedconf })
 
             call_hook("curses_feed_opt_change", [ given["feeds"] ])
 
         self.initd = True
+        self.got_configs.set()
 
     # Process new tags.
 
@@ -946,11 +1078,15 @@ class CantoCursesConfig(SubThread):
     def prot_newtags(self, tags):
 
         if not self.initd:
+            c = self.config.copy()
             for tag in tags:
                 if tag not in self.vars["strtags"]:
                     self.vars["strtags"].append(tag)
-                if tag not in self.config["tagorder"]:
-                    self.config["tagorder"].append(tag)
+                if tag not in c["tagorder"]:
+                    c["tagorder"] = c["tagorder"] + [ tag ]
+            self.config = c
+            self.publish()
+            self.refresh_options({ "tagorder" : c["tagorder"] })
             return
 
         c = self.get_conf()
@@ -971,7 +1107,10 @@ class CantoCursesConfig(SubThread):
 
                 if tag not in self.tag_config:
                     log.debug("Using default tag config for %s", tag)
-                    self.tag_config[tag] = self.tag_template_config.copy()
+                    tag_config = self.tag_config.copy()
+                    tag_config[tag] = self.tag_template_config.copy()
+                    self.tag_config = tag_config
+                    self.publish()
 
                 self.vars["strtags"].append(tag)
                 newtags.append(tag)
@@ -993,11 +1132,15 @@ class CantoCursesConfig(SubThread):
     @write_lock(config_lock)
     def prot_deltags(self, tags):
         if not self.initd:
+            c = self.config.copy()
             for tag in tags:
                 if tag in self.vars["strtags"]:
                     self.vars["strtags"].remove(tag)
-                if tag in self.config["tagorder"]:
-                    self.config["tagorder"].append(tag)
+                if tag in c["tagorder"]:
+                    c["tagorder"] = c["tagorder"] + [ tag ]
+            self.config = c
+            self.publish()
+            self.refresh_options({ "tagorder" : c["tagorder"] })
             return
 
         c = self.get_conf()
@@ -1064,8 +1207,40 @@ class CantoCursesConfig(SubThread):
     # code can "get" the conf, which is a copy of the real conf, modify it,
     # then "set" the conf which will properly process the changes.
 
+    # The get_*_opt functions, on the other hand, return values straight out of
+    # the current snapshot without copying or locking, so they're cheap enough
+    # for render paths, but their results must be treated as read-only.
+
     # prot_configs handles locking
 
+    def publish(self):
+        self.generation += 1
+        self.snapshot = ConfigSnapshot(self.generation, self.config,\
+                self.tag_config, self.daemon_defaults, self.daemon_feedconf)
+
+    # Get a precompiled handle for option. Handles are kept up to date by
+    # refresh_options(), which is called with the same change set as the
+    # curses_opt_change hook, before the hook is called.
+
+    def option(self, option):
+        if option not in self.options:
+            handle = ConfigOption(option)
+            handle.refresh(self.snapshot)
+            self.options[option] = handle
+        return self.options[option]
+
+    def refresh_options(self, changes):
+        snapshot = self.snapshot
+        for handle in list(self.options.values()):
+            if handle.affected_by(changes):
+                handle.refresh(snapshot)
+                self.option_refreshes += 1
+
+    def _tag_conf(self, snapshot, tag):
+        if tag in snapshot.tag_config:
+            return snapshot.tag_config[tag]
+        return self.tag_template_config
+
     def set_conf(self, conf):
         self.prot_configs({"CantoCurses" : conf }, True)
 
@@ -1076,9 +1251,7 @@ class CantoCursesConfig(SubThread):
         self.prot_configs({ "defaults" : conf }, True)
 
     def set_feed_conf(self, name, conf):
-        config_lock.acquire_read()
-        d_f = eval(repr(self.daemon_feedconf), {}, {})
-        config_lock.release_read()
+        d_f = eval(repr(self.snapshot.daemon_feedconf), {}, {})
 
         for f in d_f:
             if f["name"] == name:
@@ -1090,23 +1263,17 @@ class CantoCursesConfig(SubThread):
 
         self.prot_configs({ "feeds" : d_f }, True)
 
-    @read_lock(config_lock)
     def get_conf(self):
-        return eval(repr(self.config), {}, {})
+        return eval(repr(self.snapshot.config), {}, {})
 
-    @read_lock(config_lock)
     def get_tag_conf(self, tag):
-        if tag in self.tag_config:
-            return eval(repr(self.tag_config[tag]), {}, {})
-        return eval(repr(self.tag_template_config), {}, {})
+        return eval(repr(self._tag_conf(self.snapshot, tag)), {}, {})
 
-    @read_lock(config_lock)
     def get_def_conf(self):
-        return eval(repr(self.daemon_defaults), {}, {})
+        return eval(repr(self.snapshot.daemon_defaults), {}, {})
 
-    @read_lock(config_lock)
     def get_feed_conf(self, name):
-        for f in self.daemon_feedconf:
+        for f in self.snapshot.daemon_feedconf:
             if f["name"] == name:
                 return eval(repr(f), {}, {})
         return None
@@ -1117,10 +1284,8 @@ class CantoCursesConfig(SubThread):
         assign_to_dict(c, option, value)
         self.set_conf(c)
 
-    @read_lock(config_lock)
     def get_opt(self, option):
-        c = self.get_conf()
-        valid, value = access_dict(c, option)
+        valid, value = access_dict(self.snapshot.config, option)
         if not valid:
             return None
         return value
@@ -1131,9 +1296,8 @@ class CantoCursesConfig(SubThread):
         assign_to_dict(tc, option, value)
         self.set_tag_conf(tag, tc)
 
-    @read_lock(config_lock)
     def get_tag_opt(self, tag, option):
-        tc = self.get_tag_conf(tag)
+        tc = self._tag_conf(self.snapshot, tag)
         valid, value = access_dict(tc, option)
         if not valid:
             return None
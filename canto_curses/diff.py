@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#Canto-curses - ncurses RSS reader
+#   Copyright (C) 2016 Jack Miller <jack@codezen.org>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License version 2 as 
+#   published by the Free Software Foundation.
+
+# diff_ids is the shared diff engine for TagUpdater.prot_items and Tag.sync.
+# Given the current list of ids and an updated list, it returns three lists:
+#
+#   added   - [ (updated_pos, id) ] for ids only in updated, in updated order.
+#   kept    - [ (updated_pos, current_pos, id) ] for ids in both, in updated
+#             order.
+#   removed - [ (current_pos, id) ] for ids only in current, in current order.
+#
+# Every entry of updated ends up in either added or kept, so merging those two
+# by updated_pos reproduces updated. Runs in linear time using a dict lookup
+# instead of walking two sorted lists.
+
+def diff_ids(current, updated):
+    cur_pos = {}
+    for i, c_id in enumerate(current):
+        # Duplicates in current are only matched once, the rest are removed.
+        if c_id not in cur_pos:
+            cur_pos[c_id] = i
+
+    matched = [ False ] * len(current)
+
+    added = []
+    kept = []
+
+    for i, u_id in enumerate(updated):
+        c = cur_pos.pop(u_id, None)
+        if c == None:
+            added.append((i, u_id))
+        else:
+            matched[c] = True
+            kept.append((i, c, u_id))
+
+    removed = [ (i, c_id) for (i, c_id) in enumerate(current) if not matched[i] ]
+
+    return (added, kept, removed)
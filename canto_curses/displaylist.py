@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+#Canto-curses - ncurses RSS reader
+#   Copyright (C) 2016 Jack Miller <jack@codezen.org>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License version 2 as
+#   published by the Free Software Foundation.
+
+# LineIndex is a Fenwick (binary indexed) tree over a list of heights. Setting
+# a height, the line an entry starts on, and the entry covering a line are all
+# O(log n), instead of walking the list summing lines().
+
+class LineIndex(object):
+    def __init__(self, heights):
+        self.heights = heights[:]
+        self.tree = [ 0 ] + heights
+
+        n = len(heights)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self.tree[j] += self.tree[i]
+
+    def __len__(self):
+        return len(self.heights)
+
+    def set(self, idx, height):
+        delta = height - self.heights[idx]
+        if not delta:
+            return
+
+        self.heights[idx] = height
+
+        i = idx + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    # Sum of the heights before idx, i.e. the line idx starts on.
+
+    def line(self, idx):
+        r = 0
+        while idx > 0:
+            r += self.tree[idx]
+            idx -= idx & -idx
+        return r
+
+    def total(self):
+        return self.line(len(self.heights))
+
+    # Index of the entry covering line, clamped to the last entry. Entries with
+    # no height never cover anything.
+
+    def find(self, line):
+        n = len(self.heights)
+        if not n:
+            return None
+
+        idx = 0
+        step = 1
+        while step * 2 <= n:
+            step *= 2
+
+        while step:
+            if idx + step <= n and self.tree[idx + step] <= line:
+                idx += step
+                line -= self.tree[idx]
+            step //= 2
+
+        return min(idx, n - 1)
+
+# A Segment is one tag's part of the DisplayList: the tag, followed by its
+# stories unless it's collapsed, with the line heights of each.
+
+class Segment(object):
+    def __init__(self, tag, old = None):
+        self.tag = tag
+        self.pos = 0
+        self.collapsed = tag.opts.collapsed
+
+        if self.collapsed:
+            self.stories = []
+            self.sels = [ tag ]
+        else:
+            self.stories = tag[:]
+            self.sels = self.stories
+
+        self.objs = [ tag ] + self.stories
+
+        # Keep the heights we already know from the segment we're replacing.
+
+        known = {}
+        if old:
+            for obj, height in zip(old.objs, old.index.heights):
+                known[id(obj)] = height
+
+        heights = []
+        for i, obj in enumerate(self.objs):
+            obj.display_seg = self
+            obj.display_local = i
+            heights.append(known.get(id(obj), 1))
+
+        self.index = LineIndex(heights)
+
+    # Position of obj in sels, if it's selectable, or of the next selectable.
+    # Likewise for stories.
+
+    def sel_local(self, obj):
+        if obj.is_tag:
+            return 0
+        return obj.display_local - 1
+
+    def story_local(self, obj):
+        if obj.is_tag:
+            return 0
+        return obj.display_local - 1
+
+# DisplayList is what the TagList renders from: every visible object in order,
+# made of a Segment per tag. Each object knows its Segment and its place in it,
+# and Fenwick trees over the segments' object, selectable, story and line
+# counts turn those into global positions, so neighbours, jumps to the Nth
+# item and line lookups are at worst O(log n) without linking the objects
+# together, and a single tag can be replaced without touching the others.
+#
+# Heights start as an estimate of a line per object, since measuring means
+# rendering, and are filled in with set_height as the TagList measures them.
+
+class DisplayList(object):
+    def __init__(self, tags):
+        self.segs = [ Segment(tag) for tag in tags ]
+        self.reindex()
+
+    def reindex(self):
+        for i, seg in enumerate(self.segs):
+            seg.pos = i
+
+        self.seg_objs = LineIndex([ len(s.objs) for s in self.segs ])
+        self.seg_sels = LineIndex([ len(s.sels) for s in self.segs ])
+        self.seg_stories = LineIndex([ len(s.stories) for s in self.segs ])
+        self.seg_lines = LineIndex([ s.index.total() for s in self.segs ])
+
+    def tags(self):
+        return [ seg.tag for seg in self.segs ]
+
+    def _has_seg(self, seg):
+        return seg and seg.pos < len(self.segs) and self.segs[seg.pos] is seg
+
+    # Lay out the given tags, keeping the segments of tags we already have
+    # unless they're marked display_dirty. Returns the new segments.
+
+    def set_tags(self, tags):
+        segs = []
+        new_segs = []
+
+        for tag in tags:
+            old = getattr(tag, "display_seg", None)
+            if not self._has_seg(old):
+                old = None
+
+            if old and not tag.display_dirty:
+                segs.append(old)
+            else:
+                seg = Segment(tag, old)
+                segs.append(seg)
+                new_segs.append(seg)
+
+            tag.display_dirty = False
+
+        self.segs = segs
+        self.reindex()
+
+        return new_segs
+
+    # Replace the tag's segment with its current stories, returns the number
+    # of objects that took.
+
+    def update_tag(self, tag):
+        old = tag.display_seg
+        seg = Segment(tag, old)
+        seg.pos = old.pos
+        self.segs[seg.pos] = seg
+
+        self.seg_objs.set(seg.pos, len(seg.objs))
+        self.seg_sels.set(seg.pos, len(seg.sels))
+        self.seg_stories.set(seg.pos, len(seg.stories))
+        self.seg_lines.set(seg.pos, seg.index.total())
+
+        return len(seg.objs)
+
+    def __len__(self):
+        return self.seg_objs.total()
+
+    def __contains__(self, obj):
+        seg = getattr(obj, "display_seg", None)
+        if not self._has_seg(seg):
+            return False
+        return obj.display_local < len(seg.objs) and\
+                seg.objs[obj.display_local] is obj
+
+    # Position of obj in the whole list.
+
+    def pos(self, obj):
+        return self.seg_objs.line(obj.display_seg.pos) + obj.display_local
+
+    def objs(self):
+        for seg in self.segs:
+            for obj in seg.objs:
+                yield obj
+
+    # Lines
+
+    def set_height(self, obj, height):
+        seg = obj.display_seg
+        seg.index.set(obj.display_local, height)
+        self.seg_lines.set(seg.pos, seg.index.total())
+
+    def line(self, obj):
+        seg = obj.display_seg
+        return self.seg_lines.line(seg.pos) + seg.index.line(obj.display_local)
+
+    def obj_at_line(self, line):
+        pos = self.seg_lines.find(line)
+        if pos == None:
+            return None
+
+        seg = self.segs[pos]
+        return seg.objs[seg.index.find(line - self.seg_lines.line(pos))]
+
+    # Objects that aren't in the list (i.e. ones that have appeared or gone
+    # since it was built) have no neighbours.
+
+    def next_obj(self, obj):
+        if obj not in self:
+            return None
+
+        seg = obj.display_seg
+        if obj.display_local + 1 < len(seg.objs):
+            return seg.objs[obj.display_local + 1]
+        if seg.pos + 1 < len(self.segs):
+            return self.segs[seg.pos + 1].tag
+        return None
+
+    def prev_obj(self, obj):
+        if obj not in self:
+            return None
+
+        seg = obj.display_seg
+        if obj.display_local > 0:
+            return seg.objs[obj.display_local - 1]
+        if seg.pos > 0:
+            return self.segs[seg.pos - 1].objs[-1]
+        return None
+
+    # Selectables, i.e. stories and collapsed tags.
+
+    def sel_count(self):
+        return self.seg_sels.total()
+
+    def sel(self, idx):
+        if not (0 <= idx < self.sel_count()):
+            return None
+
+        pos = self.seg_sels.find(idx)
+        return self.segs[pos].sels[idx - self.seg_sels.line(pos)]
+
+    def is_sel(self, obj):
+        return (not obj.is_tag) or obj.display_seg.collapsed
+
+    # Position of obj among the selectables if it's selectable, or of the next
+    # selectable after it.
+
+    def sel_pos(self, obj):
+        seg = obj.display_seg
+        return self.seg_sels.line(seg.pos) + seg.sel_local(obj)
+
+    # Position of the first selectable after the tag's stories.
+
+    def sel_after(self, tag):
+        return self.seg_sels.line(tag.display_seg.pos + 1)
+
+    def next_sel(self, obj):
+        if obj not in self:
+            return None
+        idx = self.sel_pos(obj)
+        if self.is_sel(obj):
+            idx += 1
+        return self.sel(idx)
+
+    def prev_sel(self, obj):
+        if obj not in self:
+            return None
+        return self.sel(self.sel_pos(obj) - 1)
+
+    # Likewise for stories.
+
+    def story_count(self):
+        return self.seg_stories.total()
+
+    def story(self, idx):
+        if not (0 <= idx < self.story_count()):
+            return None
+
+        pos = self.seg_stories.find(idx)
+        return self.segs[pos].stories[idx - self.seg_stories.line(pos)]
+
+    def stories(self):
+        for seg in self.segs:
+            for story in seg.stories:
+                yield story
+
+    def story_pos(self, obj):
+        seg = obj.display_seg
+        return self.seg_stories.line(seg.pos) + seg.story_local(obj)
+
+    # Position of obj among its tag's stories.
+
+    def rel_story_pos(self, obj):
+        return obj.display_seg.story_local(obj)
+
+    def next_story(self, obj):
+        if obj not in self:
+            return None
+        idx = self.story_pos(obj)
+        if not obj.is_tag:
+            idx += 1
+        return self.story(idx)
+
+    def prev_story(self, obj):
+        if obj not in self:
+            return None
+        return self.story(self.story_pos(obj) - 1)
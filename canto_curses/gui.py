@@ -9,7 +9,7 @@
 from canto_next.plugins import Plugin
 from canto_next.format import escsplit
 
-from .tag import alltags
+from .tag import alltags, attr_dispatcher
 from .tagcore import tag_updater
 
 from .locks import sync_lock
@@ -19,11 +19,47 @@ from .config import config
 from .screen import Screen
 
 from threading import Thread, Event
+from collections import deque
 import traceback
 import logging
+import curses
+import time
 
 log = logging.getLogger("GUI")
 
+opt_max_fps = config.option("main.max_fps")
+opt_sync_budget = config.option("main.sync_budget")
+
+# Frames answering input still sync, so held keys can't starve syncing, but
+# only for this many ms (or main.sync_budget, if that's less).
+
+INPUT_SYNC_SLICE = 2
+
+# FrameStats keeps the timings of the last few frames, in seconds, spent
+# syncing tags, refreshing, redrawing and in doupdate().
+
+class FrameStats(object):
+    def __init__(self, keep=100):
+        self.frames = deque(maxlen = keep)
+        self.total = 0
+
+    def add(self, synced, sync, refresh, redraw, update):
+        self.frames.append((synced, sync, refresh, redraw, update))
+        self.total += 1
+
+    def summary(self):
+        if not self.frames:
+            return "No frames drawn."
+
+        n = len(self.frames)
+        synced = sum(f[0] for f in self.frames)
+        avg = [ 1000 * sum(f[i] for f in self.frames) / n for i in range(1, 5) ]
+        worst = 1000 * max(sum(f[1:]) for f in self.frames)
+
+        return ("%d frames (last %d: %d tags synced, avg ms sync %.1f"
+                " refresh %.1f redraw %.1f doupdate %.1f, worst %.1f)") %\
+                (self.total, n, synced, avg[0], avg[1], avg[2], avg[3], worst)
+
 class GraphicalLog(logging.Handler):
 
     # We want to be able to catch logging output before the screen is actually
@@ -91,6 +127,11 @@ class CantoCursesGui(CommandHandler):
         self.do_gui = Event()
         self.do_gui.set()
 
+        # Set by the input thread, so the next frame is drawn right away.
+        self.input_pending = False
+        self.next_frame = 0
+        self.frame_stats = FrameStats()
+
         self.working = False
 
         self.callbacks = {
@@ -134,6 +175,9 @@ class CantoCursesGui(CommandHandler):
         register_command(self, "refresh", self.cmd_refresh, [], "Refetch everything from the daemon", "Base")
         register_command(self, "update", self.cmd_update, [], "Sync with daemon", "Base")
         register_command(self, "quit", self.cmd_quit, [], "Quit canto-curses", "Base")
+        register_command(self, "frame-stats", self.cmd_frame_stats, [], "Show recent frame timings", "Base")
+        register_command(self, "write-stats", self.cmd_write_stats, [], "Show daemon write queue stats", "Base")
+        register_command(self, "attr-cache", self.cmd_attr_cache, [], "Show the size of cached story content", "Base")
 
         self.input_thread = Thread(target = self.run)
         self.input_thread.daemon = True
@@ -148,13 +192,13 @@ class CantoCursesGui(CommandHandler):
         self.do_gui.set()
 
     def tick(self):
-        c = self.callbacks["get_conf"]()
-        if c["update"]["auto"]["enabled"]:
+        auto = self.callbacks["get_opt"]("update.auto")
+        if auto["enabled"]:
             self.sync_timer -= 1
             if self.sync_timer <= 0:
                 self.sync_requested = True
                 self.release_gui()
-                self.sync_timer = c["update"]["auto"]["interval"]
+                self.sync_timer = auto["interval"]
         else:
             self.sync_timer = 1
             if self.sync_requested:
@@ -175,6 +219,17 @@ class CantoCursesGui(CommandHandler):
     def cmd_quit(self):
         self.alive = False
 
+    def cmd_frame_stats(self):
+        log.info(self.frame_stats.summary())
+
+    def cmd_attr_cache(self):
+        log.info("Attribute cache: %s" % tag_updater.cold_summary())
+
+    def cmd_write_stats(self):
+        log.info("Config: %s\nTags: %s, %d attribute requests saved" %\
+                (config.write_stats.summary(), tag_updater.write_stats.summary(),
+                    tag_updater.requests_saved))
+
     def cmdsplit(self, cmd):
         r = escsplit(cmd, " &")
 
@@ -240,14 +295,83 @@ class CantoCursesGui(CommandHandler):
                     break
 
             # Let the GUI thread process, or realize it's dead.
+            self.input_pending = True
             self.release_gui()
 
+    # Wait out the rest of the frame interval, unless there's input or a
+    # resize, which are drawn immediately.
+
+    def wait_frame(self):
+        while not (self.input_pending or self.winched or not self.alive):
+            delay = self.next_frame - time.time()
+            if delay <= 0:
+                break
+            self.do_gui.wait(delay)
+            self.do_gui.clear()
+
+    # Sync tags until the budget's spent, at least one (or part of one) per
+    # frame. Returns the number of tags synced.
+
+    def sync_tags(self, budget):
+        if self.sync_requested:
+            self.tags_to_sync = alltags[:]
+            self.sync_requested = False
+        else:
+            # Tags compare by content, so track pending ones by identity.
+            pending = set([ id(t) for t in self.tags_to_sync ])
+            for tag in alltags:
+                if (id(tag) not in pending) and (tag.tagcore.was_reset or\
+                        tag.sync_job or\
+                        (len(tag) == 0 and len(tag.tagcore) != 0)):
+                    self.tags_to_sync.append(tag)
+
+        deadline = time.time() + budget
+        synced = 0
+        waiting = []
+
+        # Tags that are waiting on the sync worker, or didn't finish in time,
+        # stay first in line for a later frame.
+
+        while self.tags_to_sync:
+            tag = self.tags_to_sync.pop(0)
+            if not tag.sync(deadline = deadline):
+                waiting.append(tag)
+            synced += 1
+            if time.time() >= deadline:
+                break
+
+        self.tags_to_sync = waiting + self.tags_to_sync
+        return synced
+
+    # Whether there's syncing we can do now. Tags waiting on the sync worker
+    # don't count, it releases the GUI when they're ready.
+
+    def sync_ready(self):
+        if self.sync_requested:
+            return True
+        for tag in self.tags_to_sync:
+            if tag.sync_ready():
+                return True
+        return False
+
+    # The GUI thread draws at most main.max_fps frames a second, coalescing
+    # everything that became dirty in between into one refresh and redraw.
+    # Each frame spends up to main.sync_budget ms syncing tags, except frames
+    # that are answering input, which only get INPUT_SYNC_SLICE ms so they're
+    # drawn as soon as possible.
+
     def run_gui(self):
         while True:
             self.do_gui.wait()
             self.do_gui.clear()
             log.debug("gui thread released")
 
+            self.wait_frame()
+
+            max_fps = opt_max_fps()
+            if max_fps:
+                self.next_frame = time.time() + 1.0 / max_fps
+
             if not self.alive:
 
                 # Remove graphical log handler so log.infos don't screw up the
@@ -262,22 +386,22 @@ class CantoCursesGui(CommandHandler):
 
             self.glog_handler.flush_deferred_logs()
 
-            partial_sync = False
+            # Deliver attribute changes that arrived since the last frame.
+            attr_dispatcher.flush()
+
             self.working = True
 
-            if self.sync_requested:
-                self.tags_to_sync = alltags[:]
-                self.sync_requested = False
-            else:
-                for tag in alltags:
-                    if (tag not in self.tags_to_sync) and (tag.tagcore.was_reset or\
-                            (len(tag) == 0 and len(tag.tagcore) != 0)):
-                        self.tags_to_sync.append(tag)
+            input_frame = self.input_pending
+            self.input_pending = False
+
+            t_start = time.time()
 
-            if self.tags_to_sync:
-                self.tags_to_sync[0].sync()
-                self.tags_to_sync = self.tags_to_sync[1:]
-                partial_sync = True
+            budget = opt_sync_budget()
+            if input_frame:
+                budget = min(budget, INPUT_SYNC_SLICE)
+            synced = self.sync_tags(budget / 1000.0)
+
+            t_sync = time.time()
 
             needs_resize = self.callbacks["get_var"]("needs_resize") or self.winched
             needs_refresh = self.callbacks["get_var"]("needs_refresh")
@@ -291,21 +415,35 @@ class CantoCursesGui(CommandHandler):
             if needs_resize:
                 self.winched = False
                 self.screen.resize()
+                t_refresh = t_redraw = time.time()
             else:
                 if needs_refresh:
                     self.screen.refresh()
+                t_refresh = time.time()
 
                 if needs_redraw:
-                    self.screen.redraw()
+                    self.screen.redraw(False)
+                    t_redraw = time.time()
+                    curses.doupdate()
+                else:
+                    t_redraw = t_refresh
+
+            t_update = time.time()
+
+            if needs_resize or needs_refresh or needs_redraw or synced:
+                self.frame_stats.add(synced, t_sync - t_start,
+                        t_refresh - t_sync, t_redraw - t_refresh,
+                        t_update - t_redraw)
 
             needs_resize = self.callbacks["get_var"]("needs_resize") or self.winched
             needs_refresh = self.callbacks["get_var"]("needs_refresh")
             needs_redraw = self.callbacks["get_var"]("needs_redraw")
 
-            # If we weren't able to clear the condition, then
-            # we'll drop locks and immediately go again.
+            # If we weren't able to clear the condition, or there are tags
+            # ready to sync, then we'll drop locks and go again next frame.
 
-            if needs_resize or needs_refresh or needs_redraw or partial_sync:
+            if needs_resize or needs_refresh or needs_redraw or\
+                    self.sync_ready():
                 self.do_gui.set()
             else:
                 self.working = False
@@ -255,7 +255,7 @@ Common options:
         self._remote("%s %s" % (remote_cmd, args))
 
     def _goto(self, urls):
-        browser = self.callbacks["get_conf"]()["browser"]
+        browser = self.callbacks["get_opt"]("browser")
 
         if not browser["path"]:
             log.error("No browser defined! Cannot goto.")
@@ -199,6 +199,10 @@ class CantoCurses(CantoClient):
 
         # Get config from daemon
         if not config.init(self, CANTO_PROTOCOL_COMPATIBLE):
+            if config.handshake_state == "timeout":
+                print("Timed out waiting for daemon")
+                sys.exit(-1)
+
             print("Invalid daemon version")
             print("Wanted: %s" % CANTO_PROTOCOL_COMPATIBLE)
             print("Got: %s" % config.version)
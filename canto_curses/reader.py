@@ -99,7 +99,10 @@ class Reader(TextBox):
 
         sel = self.callbacks["get_var"]("reader_item")
         if sel:
-            self.links = [("link",sel.content["link"],"mainlink")]
+            # Keep what we're reading from being evicted.
+            tag_updater.touch([ sel.id ])
+
+            self.links = [("link",sel.content.get("link", ""),"mainlink")]
 
             s = "%B" + prep_for_display(sel.content["title"]) + "%b\n"
 
@@ -111,7 +114,7 @@ class Reader(TextBox):
             # a hook to get notified when sel's attributes are changed.
 
             l = ["description", "content", "links", "media_content",
-                    "enclosures"]
+                    "enclosures", "link"]
 
             for attr in l:
                 if attr not in sel.content:
@@ -247,20 +247,22 @@ Arguments:"""),
     def _subw_size_height(self, ci, height):
         window_conf = self.callbacks["get_opt"](ci.get_opt_name() + ".window")
 
-        if not window_conf["maxheight"]:
-            window_conf["maxheight"] = height
+        maxheight = window_conf["maxheight"]
+        if not maxheight:
+            maxheight = height
         req_height = ci.get_height(height)
 
-        return min(height, window_conf["maxheight"], req_height)
+        return min(height, maxheight, req_height)
 
     def _subw_size_width(self, ci, width):
         window_conf = self.callbacks["get_opt"](ci.get_opt_name() + ".window")
 
-        if not window_conf["maxwidth"]:
-            window_conf["maxwidth"] = width
+        maxwidth = window_conf["maxwidth"]
+        if not maxwidth:
+            maxwidth = width
         req_width = ci.get_width(width)
 
-        return min(width, window_conf["maxwidth"], req_width)
+        return min(width, maxwidth, req_width)
 
     # _subw_layout_size will return the total size of layout
     # in either height or width where layout is a list of curses
@@ -713,10 +715,13 @@ Arguments:"""),
         for c in self.tiles + self.floats:
             c.refresh()
 
-    def redraw(self):
+    # Pass update = False to do the doupdate() yourself.
+
+    def redraw(self, update=True):
         for c in self.tiles + self.floats:
             c.redraw()
-        curses.doupdate()
+        if update:
+            curses.doupdate()
 
     # Typical curses resize, endwin and re-setup.
     def resize(self):
@@ -820,7 +825,7 @@ Arguments:"""),
         return (styles, lambda x: (x in styles, x))
 
     def cmd_style(self, name, style):
-        conf = self.callbacks["get_opt"]("style")
+        conf = self.callbacks["get_opt"]("style").copy()
 
         styles = {
             "bold" : "%B",
@@ -7,11 +7,10 @@
 #   published by the Free Software Foundation.
 
 from canto_next.plugins import Plugin, PluginHandler
-from canto_next.hooks import on_hook, unhook_all
 
-from .theme import FakePad, WrapPad, theme_print, theme_len, theme_reset, theme_border, prep_for_display
+from .theme import LineBuffer, RenderEntries, render_cache, theme_print, theme_len, theme_reset, theme_border, prep_for_display
 from .tagcore import tag_updater
-from .config import story_needed_attrs
+from .config import config, story_needed_attrs
 from .color import cc
 
 import traceback
@@ -20,6 +19,12 @@ import curses
 
 log = logging.getLogger("STORY")
 
+# Precompiled option handles, so rendering doesn't walk the config.
+
+opt_enumerated = config.option("story.enumerated")
+opt_border = config.option("taglist.border")
+opt_wrap = config.option("taglist.wrap")
+
 class StoryPlugin(Plugin):
     pass
 
@@ -38,6 +43,13 @@ class Story(PluginHandler):
         self.is_dead = False
         self.id = id
         self.pad = None
+        self.buf = None
+        self.sel_spans = []
+
+        # Bumped whenever anything but marking changes how we render, for the
+        # render cache.
+        self.version = 0
+        self.render_cache = RenderEntries()
 
         self.selected = False
         self.marked = False
@@ -57,21 +69,18 @@ class Story(PluginHandler):
         self.pre_format = ""
         self.post_format = ""
 
-        # Offset globally and in-tag.
+        # Offset globally and in-tag. These aren't part of our rendering, the
+        # TagList draws them over it (see enum_header), so they can change
+        # without a re-render.
         self.offset = 0
         self.rel_offset = 0
-        self.enumerated = False
-        self.rel_enumerated = False
 
-        # This should exist before the hook is setup, or the hook will fail.
-        self.content = {}
+        # Stories don't register hooks of their own. The owning Tag passes
+        # option changes and attribute deltas on to on_opt_change and
+        # on_attributes, so dying is just dropping out of the Tag.
 
-        on_hook("curses_opt_change", self.on_opt_change, self)
-        on_hook("curses_tag_opt_change", self.on_tag_opt_change, self)
-        on_hook("curses_attributes", self.on_attributes, self)
-
-        # Grab initial content, if any, the rest will be handled by the
-        # attributes hook
+        # Grab initial content, if any, the rest will be delivered by the
+        # Tag's attribute dispatcher
 
         self.content = tag_updater.get_attributes(self.id)
         self.new_content = None
@@ -81,7 +90,7 @@ class Story(PluginHandler):
 
     def die(self):
         self.is_dead = True
-        unhook_all(self)
+        render_cache.forget(self.render_cache)
 
     def __eq__(self, other):
         if not other:
@@ -93,15 +102,14 @@ class Story(PluginHandler):
     def __str__(self):
         return "story: %s" % self.id
 
-    # On_attributes updates new_content. We don't lock because we don't
-    # particularly care what version of new_content the next sync() call gets.
-
-    def on_attributes(self, attributes):
-        if self.id in attributes:
-            new_content = attributes[self.id]
+    # On_attributes takes this story's new attributes. It's called by the Tag
+    # from the attribute dispatcher's flush, with sync_lock held, so the new
+    # content is applied right away.
 
-            if not (new_content is self.content):
-                self.new_content = new_content
+    def on_attributes(self, new_content):
+        if not (new_content is self.content):
+            self.new_content = new_content
+            self.sync()
 
     def sync(self):
         if self.new_content == None:
@@ -131,24 +139,10 @@ class Story(PluginHandler):
         if "story" not in config:
             return
 
-        if "format_attrs" in config["story"]:
-            needed_attrs = []
-            for attr in config["story"]["format_attrs"]:
-                if attr not in self.content:
-                    needed_attrs.append(attr)
-            if needed_attrs:
-                log.debug("%s needs: %s", self.id, needed_attrs)
-                tag_updater.need_attributes(self.id, needed_attrs)
-
         # All other story options are formats / enumerations, redraw.
 
         self.need_redraw()
 
-    def on_tag_opt_change(self, config):
-        tagname = self.callbacks["get_tag_name"]()
-        if tagname in config and "enumerated" in config[tagname]:
-            self.need_redraw()
-
     # Add / remove state. Return True if an actual change, False otherwise.
 
     def _handle_key(self, attr, key):
@@ -208,54 +202,58 @@ class Story(PluginHandler):
             self.callbacks["item_state_change"](self)
         return r
 
+    # Selection is drawn over our rendering by the TagList (see sel_spans), so
+    # it only needs the window redrawn.
+
     def select(self):
         if not self.selected:
             self.selected = True
-            self.need_redraw()
+            self.callbacks["set_var"]("needs_redraw", True)
 
     def unselect(self):
         if self.selected:
             self.selected = False
-            self.need_redraw()
+            self.callbacks["set_var"]("needs_redraw", True)
 
     def mark(self):
         if not self.marked:
             self.marked = True
-            self.need_redraw()
+            self.need_state_redraw()
             return True
         return False
 
     def unmark(self):
         if self.marked:
             self.marked = False
-            self.need_redraw()
+            self.need_state_redraw()
             return True
         return False
 
+    # Offsets are drawn at draw time, so changing them doesn't need a redraw
+    # of its own, it's picked up by whatever redraw moved us.
+
     def set_offset(self, offset):
-        if self.offset != offset:
-            self.offset = offset
-            self.need_redraw()
+        self.offset = offset
 
     def set_rel_offset(self, offset):
-        if self.rel_offset != offset:
-            self.rel_offset = offset
-            self.need_redraw()
-
-    # This is not useful in the interface,
-    # so no redraw required on it.
-
-    def set_sel_offset(self, offset):
-        self.sel_offset = offset
+        self.rel_offset = offset
 
     def need_redraw(self):
+        self.version += 1
         self.changed = True
         self.callbacks["set_var"]("needs_redraw", True)
 
     def need_refresh(self):
+        self.version += 1
         self.changed = True
         self.callbacks["set_var"]("needs_refresh", True)
 
+    # Marking is part of the render cache key, so it doesn't bump the version.
+
+    def need_state_redraw(self):
+        self.changed = True
+        self.callbacks["set_var"]("needs_redraw", True)
+
     def eval(self):
         s = ""
 
@@ -267,14 +265,8 @@ class Story(PluginHandler):
         if self.marked:
             s += cc("marked") + "[*]"
 
-        if self.selected:
-            s += cc("selected")
-
         s += prep_for_display(self.content["title"])
 
-        if self.selected:
-            s += cc.end("selected")
-
         if self.marked:
             s += cc.end("marked")
 
@@ -292,9 +284,6 @@ class Story(PluginHandler):
         # Make sure we actually have all of the attributes needed
         # to complete the render.
 
-        self.enumerated = self.callbacks["get_opt"]("story.enumerated")
-        self.rel_enumerated = self.callbacks["get_tag_opt"]("enumerated")
-
         for attr in story_needed_attrs:
             if attr not in self.content:
 
@@ -313,9 +302,23 @@ class Story(PluginHandler):
 
                 self.evald_string = "Waiting on content..."
 
+                self.buf = LineBuffer(width)
+                self.render(self.buf, width)
+                self.sel_spans = []
+
                 self.lns = 1
                 return self.lns
 
+        self.pad = None
+        self.width = width
+        self.changed = False
+
+        key = (width, self.version, self.marked)
+        cached = render_cache.get(self.render_cache, key)
+        if cached:
+            self.buf, self.lns, self.sel_spans = cached
+            return self.lns
+
         for attr in list(self.plugin_attrs.keys()):
             if not attr.startswith("edit_"):
                 continue
@@ -327,9 +330,7 @@ class Story(PluginHandler):
 
         self.evald_string = self.eval()
 
-        taglist_conf = self.callbacks["get_opt"]("taglist")
-
-        if taglist_conf["border"]:
+        if opt_border():
             self.left = "%C%B" + theme_border("ls") + "%b %c"
             self.left_more = "%C%B" + theme_border("ls") + "%b     %c"
             self.right = "%C %B" + theme_border("rs") + "%b%c"
@@ -338,14 +339,15 @@ class Story(PluginHandler):
             self.left_more = "%C     %c"
             self.right = "%C %c"
 
-        self.pad = None
-        self.width = width
-        self.changed = False
-
-        self.lns = self.render(FakePad(width), width)
-        if (not taglist_conf["wrap"]) and self.lns:
+        self.buf = LineBuffer(width)
+        self.lns = self.render(self.buf, width)
+        if (not opt_wrap()) and self.lns:
             self.lns = 1
 
+        render_cache.put(self.render_cache, key,
+                (self.buf, self.lns, self.sel_spans), self.buf.size(),
+                lambda k : k[1] == self.version)
+
         return self.lns
 
     def pads(self, width):
@@ -353,14 +355,30 @@ class Story(PluginHandler):
             return self.lns
 
         self.pad = curses.newpad(self.lines(width), width)
-        self.render(WrapPad(self.pad), width)
+        self.buf.blit(self.pad)
         return self.lns
 
+    # The offset information the TagList draws over our first line.
+
+    def enum_header(self):
+        header = ""
+        if opt_enumerated():
+            header += cc("enum_hints") + "[" + str(self.offset) + "]%0"
+        if self.callbacks["get_tag_opt"]("enumerated"):
+            header += cc("enum_hints") + "[" + str(self.rel_offset) + "]%0"
+        return header
+
     def render(self, pad, width):
         s = self.evald_string
 
         lines = 0
 
+        # The columns the title takes up on each line, between the borders and
+        # past the [*] of a marked story.
+
+        self.sel_spans = []
+        right = width - theme_len(self.right)
+
         try:
             while s:
                 # Left border, for first line
@@ -373,22 +391,11 @@ class Story(PluginHandler):
 
                 s = theme_print(pad, s, width, l, self.right)
 
-                # Handle overwriting with offset information
-
-                if lines == 0:
-                    header = ""
-                    if self.enumerated:
-                        header += cc("enum_hints") + "[" + str(self.offset) + "]%0"
-                    if self.rel_enumerated:
-                        header += cc("enum_hints") + "[" + str(self.rel_offset) + "]%0"
-                    if header:
-                        pad.move(0, 0)
-                        theme_print(pad, header, width, "","", False, False)
-                        try:
-                            pad.move(1, 0)
-                        except:
-                            pass
+                left = theme_len(l)
+                if lines == 0 and self.marked:
+                    left += 3
 
+                self.sel_spans.append((lines, left, right))
                 lines += 1
 
         # Render exceptions should be non-fatal. The worst
@@ -9,12 +9,94 @@
 # SubThread is just a basic wrapper for a sub connection from the backend that
 # dispatches to sub functions based on socket traffic
 
-from threading import Thread, Lock
+from canto_next.hooks import on_hook
+
+from threading import Thread, Lock, Condition
 import traceback
 import logging
+import time
 
 log = logging.getLogger("SUBTHREAD")
 
+# How long the writer waits for more requests to merge with one it could
+# merge, in seconds.
+
+WRITE_WINDOW = 0.005
+
+# Adjacent requests with these commands are merged into one, given the
+# merged arguments so far (a copy the merger can modify) and the next ones.
+
+def merge_attributes(merged, args):
+    for s_id, attrs in args.items():
+        if s_id in merged:
+            merged[s_id] = merged[s_id] + [ a for a in attrs if a not in merged[s_id] ]
+        else:
+            merged[s_id] = attrs
+    return merged
+
+def merge_setattributes(merged, args):
+    for s_id, attrs in args.items():
+        if s_id in merged:
+            merged[s_id] = dict(merged[s_id])
+            merged[s_id].update(attrs)
+        else:
+            merged[s_id] = attrs
+    return merged
+
+# AUTOATTR always sends the complete list, so the last one wins.
+
+def merge_autoattr(merged, args):
+    return args
+
+mergers = {
+    "ATTRIBUTES" : merge_attributes,
+    "SETATTRIBUTES" : merge_setattributes,
+    "AUTOATTR" : merge_autoattr,
+}
+
+# Merged requests of these commands are split once they cover this many ids,
+# so no one message (or response) gets huge.
+
+merge_limits = {
+    "ATTRIBUTES" : 256,
+}
+
+def merge_writes(queue):
+    r = []
+
+    for cmd, args, queued in queue:
+        if r and r[-1][0] == cmd and cmd in mergers and\
+                len(r[-1][1]) < merge_limits.get(cmd, len(r[-1][1]) + 1):
+            last_cmd, merged, first_queued, count = r[-1]
+            if count == 1:
+                merged = merged.copy()
+            r[-1] = (cmd, mergers[cmd](merged, args), first_queued, count + 1)
+        else:
+            r.append((cmd, args, queued, 1))
+
+    return r
+
+# WriteStats keeps the writer's counters. Latency is from write() to the
+# request (or the first one merged into it) being sent, in seconds.
+
+class WriteStats(object):
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.merged = 0
+        self.max_depth = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def summary(self):
+        avg = 0.0
+        if self.sent:
+            avg = 1000 * self.latency / self.sent
+
+        return ("%d queued, %d sent (%d merged), max depth %d, latency avg"
+                " %.1f ms max %.1f ms") % (self.queued, self.sent, self.merged,
+                        self.max_depth, avg, 1000 * self.max_latency)
+
 class SubThread(object):
     def init(self, backend):
         self.backend = backend
@@ -24,6 +106,22 @@ class SubThread(object):
         self.prot_thread = None
         self.alive = False
 
+        # Outbound requests are queued and sent by the writer thread, so the
+        # threads making them never block on the socket.
+
+        self.write_cond = Condition()
+        self.write_queue = []
+        self.writing = False
+        self.write_stats = WriteStats()
+
+        self.write_thread = Thread(target=self.writer)
+        self.write_thread.daemon = True
+        self.write_thread.start()
+
+        # Don't lose anything still queued when we exit.
+
+        on_hook("curses_exit", self.flush_writes, self)
+
     def prot_except(self, exception):
         log.error("%s" % exception)
 
@@ -36,7 +134,68 @@ class SubThread(object):
         log.info("%s" % info)
 
     def write(self, cmd, args):
-        return self.backend.do_write(self.conn, cmd, args)
+        self.write_cond.acquire()
+
+        self.write_queue.append((cmd, args, time.time()))
+
+        stats = self.write_stats
+        stats.queued += 1
+        stats.max_depth = max(stats.max_depth, len(self.write_queue))
+
+        self.write_cond.notify_all()
+        self.write_cond.release()
+
+    def writer(self):
+        while True:
+            self.write_cond.acquire()
+            while not self.write_queue:
+                self.write_cond.wait()
+
+            # Give requests we can merge a moment to pile up.
+
+            if self.write_queue[-1][0] in mergers:
+                self.write_cond.release()
+                time.sleep(WRITE_WINDOW)
+                self.write_cond.acquire()
+
+            queue = self.write_queue
+            self.write_queue = []
+            self.writing = True
+            self.write_cond.release()
+
+            for cmd, args, queued, count in merge_writes(queue):
+                try:
+                    self.backend.do_write(self.conn, cmd, args)
+                except Exception as e:
+                    log.error("Write exception: %s" % (e,))
+                    log.error(''.join(traceback.format_exc()))
+
+                latency = time.time() - queued
+
+                stats = self.write_stats
+                stats.sent += 1
+                stats.merged += count - 1
+                stats.latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+
+            self.write_cond.acquire()
+            self.writing = False
+            self.write_cond.notify_all()
+            self.write_cond.release()
+
+    # Wait (up to timeout seconds) for everything queued to be sent.
+
+    def flush_writes(self, timeout=1.0):
+        end = time.time() + timeout
+
+        self.write_cond.acquire()
+        while self.write_queue or self.writing:
+            remaining = end - time.time()
+            if remaining <= 0:
+                log.warn("Timed out flushing %d writes", len(self.write_queue))
+                break
+            self.write_cond.wait(remaining)
+        self.write_cond.release()
 
     def read(self):
         return self.backend.do_read(self.conn)
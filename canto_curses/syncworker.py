@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#Canto-curses - ncurses RSS reader
+#   Copyright (C) 2016 Jack Miller <jack@codezen.org>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License version 2 as
+#   published by the Free Software Foundation.
+
+# The SyncWorker diffs a Tag's ids against its TagCore off of the GUI thread,
+# so the diff for a big update doesn't happen under sync_lock while keystrokes
+# wait.
+
+from .diff import diff_ids
+
+from threading import Thread, Lock
+from queue import Queue
+import traceback
+import logging
+
+log = logging.getLogger("SYNCWORKER")
+
+# A SyncJob is one Tag sync in progress. The worker diffs the ids the Tag had
+# when the job was queued against its TagCore and posts the diff. The GUI
+# thread applies it, and then takes the new (place, id) pairs a chunk at a
+# time on each sync(), building their Story objects itself, until the job's
+# done.
+
+class SyncJob(object):
+    CHUNK = 256
+
+    def __init__(self, tag, ids):
+        self.tag = tag
+        self.ids = ids
+
+        self.lock = Lock()
+        self.diff = None
+
+        # Set by the GUI thread when it's superseded or its Tag dies.
+        self.cancelled = False
+
+        # Only touched by the GUI thread, once the diff is posted.
+        self.diff_applied = False
+        self.merged = 0
+
+    def post_diff(self, diff):
+        self.lock.acquire()
+        self.diff = diff
+        self.lock.release()
+
+    def get_diff(self):
+        self.lock.acquire()
+        r = self.diff
+        self.lock.release()
+        return r
+
+    # Whether there's anything for the GUI thread to do.
+
+    def ready(self):
+        diff = self.get_diff()
+        if diff == None:
+            return False
+        return not self.diff_applied or self.merged < len(diff[0])
+
+    # The next chunk of new (place, id) pairs, empty when there are none left.
+
+    def take(self):
+        new_ids = self.diff[0]
+        chunk = new_ids[self.merged:self.merged + self.CHUNK]
+        self.merged += len(chunk)
+        return chunk
+
+    def finished(self):
+        return self.diff_applied and self.merged >= len(self.diff[0])
+
+class SyncWorker(object):
+    def __init__(self):
+        self.jobs = Queue()
+        self.thread = None
+
+    def queue(self, job):
+        if not self.thread:
+            self.thread = Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+        self.jobs.put(job)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                continue
+
+            try:
+                self.prepare(job)
+            except Exception as e:
+                log.error("Sync exception: %s" % (e,))
+                log.error(''.join(traceback.format_exc()))
+
+                if job.get_diff() == None:
+                    job.post_diff(([], [], []))
+                job.tag.callbacks["release_gui"]()
+
+    def prepare(self, job):
+        tag = job.tag
+
+        tag.tagcore.lock.acquire_read()
+        diff = diff_ids(job.ids, tag.tagcore)
+        tag.tagcore.lock.release_read()
+
+        job.post_diff(diff)
+
+        tag.callbacks["release_gui"]()
+
+sync_worker = SyncWorker()
@@ -11,17 +11,26 @@ from canto_next.plugins import Plugin, PluginHandler
 from canto_next.rwlock import read_lock
 
 from .locks import sync_lock, config_lock
-from .theme import FakePad, WrapPad, theme_print, theme_reset, theme_border, prep_for_display
+from .theme import LineBuffer, RenderEntries, render_cache, theme_print, theme_reset, theme_border, prep_for_display
 from .config import config
 from .story import Story
+from .syncworker import SyncJob, sync_worker
 from .color import cc
 
+from threading import Lock
 import traceback
 import logging
 import curses
+import time
 
 log = logging.getLogger("TAG")
 
+# Precompiled option handles, so rendering doesn't walk the config.
+
+opt_border = config.option("taglist.border")
+opt_tags_enumerated = config.option("taglist.tags_enumerated")
+opt_tags_enumerated_absolute = config.option("taglist.tags_enumerated_absolute")
+
 # TagCore provides the core tag functionality of keeping track of a list of IDs.
 
 # The Tag class manages stories. Externally, it looks like a Tag takes IDs from
@@ -31,7 +40,102 @@ log = logging.getLogger("TAG")
 class TagPlugin(Plugin):
     pass
 
+# TagOptions holds a Tag's resolved tag config. It's filled once from the
+# config snapshot and then kept current with the curses_tag_opt_change deltas,
+# so reading an option is a plain attribute access. refills counts how many
+# times any TagOptions has been filled from the whole config, which deltas
+# don't do.
+
+class TagOptions(object):
+    refills = 0
+
+    def __init__(self, tag):
+        conf = {}
+        for key in config.tag_template_config:
+            conf[key] = config.get_tag_opt(tag, key)
+        self.update(conf)
+        TagOptions.refills += 1
+
+    def update(self, conf):
+        for key in conf:
+            setattr(self, key, conf[key])
+
+    def get(self, option):
+        return getattr(self, option, None)
+
+# Every Tag, in creation order, and by name for lookups.
+
 alltags = []
+tags_by_name = {}
+
+# Stories don't subscribe to hooks, their Tag fans each event out to them.
+# story_hook_calls counts the story callbacks invoked per hook, for profiling.
+# Since the TagList draws the enumeration, no tag option change reaches the
+# stories, so curses_tag_opt_change stays at 0.
+
+story_hook_calls = {
+    "curses_opt_change" : 0,
+    "curses_tag_opt_change" : 0,
+    "curses_attributes" : 0,
+}
+
+# The AttributeDispatcher is the only curses_attributes listener for stories.
+# The protocol thread merges each delta (id -> new attributes) into pending,
+# and the GUI thread flushes it once per frame, so several ATTRIBUTES messages
+# arriving between frames only touch each story once. Deltas are routed by
+# tags_by_id (id -> Tags holding a Story for it), which Tag.sync() maintains,
+# instead of every Story probing every message.
+
+class AttributeDispatcher(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = {}
+        self.tags_by_id = {}
+
+        on_hook("curses_attributes", self.on_attributes)
+
+    def on_attributes(self, attributes):
+        self.lock.acquire()
+        self.pending.update(attributes)
+        self.lock.release()
+
+    def add_ids(self, tag, ids):
+        for s_id in ids:
+            tags = self.tags_by_id.setdefault(s_id, [])
+
+            # Tags compare by content, so check identity.
+            for t in tags:
+                if t is tag:
+                    break
+            else:
+                tags.append(tag)
+
+    def remove_ids(self, tag, ids):
+        for s_id in ids:
+            if s_id not in self.tags_by_id:
+                continue
+            tags = self.tags_by_id[s_id]
+            for i, t in enumerate(tags):
+                if t is tag:
+                    del tags[i]
+                    break
+            if not tags:
+                del self.tags_by_id[s_id]
+
+    # Called from the GUI thread with sync_lock held.
+
+    def flush(self):
+        self.lock.acquire()
+        pending = self.pending
+        self.pending = {}
+        self.lock.release()
+
+        for s_id, attributes in pending.items():
+            for tag in self.tags_by_id.get(s_id, []):
+                tag.on_story_attributes(s_id, attributes)
+                story_hook_calls["curses_attributes"] += 1
+
+attr_dispatcher = AttributeDispatcher()
 
 class Tag(PluginHandler, list):
     def __init__(self, tagcore, callbacks):
@@ -43,8 +147,25 @@ class Tag(PluginHandler, list):
         self.is_tag = True
         self.updates_pending = 0
 
+        # Story id -> Story for every story in self, maintained by sync()
+        self.id_index = {}
+
+        # State of an unfinished sync (see sync())
+        self.sync_job = None
+        self.sync_style = None
+        self.sync_kept = 0
+        self.sync_places = {}
+
         self.pad = None
         self.footpad = None
+        self.buf = None
+        self.footbuf = None
+        self.sel_spans = []
+
+        # Bumped whenever anything changes how we render, for the render
+        # cache.
+        self.version = 0
+        self.render_cache = RenderEntries()
 
         # Note that Tag() is only given the top-level CantoCursesGui
         # callbacks as it shouldn't be doing input / refreshing
@@ -52,11 +173,12 @@ class Tag(PluginHandler, list):
 
         self.callbacks = callbacks.copy()
 
+        self.opts = TagOptions(self.tag)
+
         # Modify our own callbacks so that *_tag_opt assumes
         # the current tag.
 
-        self.callbacks["get_tag_opt"] =\
-                lambda x : callbacks["get_tag_opt"](self.tag, x)
+        self.callbacks["get_tag_opt"] = self.opts.get
         self.callbacks["set_tag_opt"] =\
                 lambda x, y : callbacks["set_tag_opt"](self.tag, x, y)
         self.callbacks["get_tag_name"] = lambda : self.tag
@@ -82,28 +204,29 @@ class Tag(PluginHandler, list):
 
         self.collapsed = False
         self.border = False
-        self.enumerated = False
-        self.abs_enumerated = False
 
         # Formats for plugins to override
         self.pre_format = ""
         self.post_format = ""
 
-        # Global indices (for enumeration)
-        self.item_offset = -1
+        # Global indices (for enumeration). Like the stories' offsets, these
+        # are drawn over our rendering by the TagList (see enum_header).
         self.visible_tag_offset = -1
         self.tag_offset = -1
-        self.sel_offset = -1
+
+        # Whether our stories, or whether they're shown, have changed since
+        # the TagList last laid us out.
+        self.display_dirty = True
 
         on_hook("curses_opt_change", self.on_opt_change, self)
         on_hook("curses_tag_opt_change", self.on_tag_opt_change, self)
-        on_hook("curses_attributes", self.on_attributes, self)
         on_hook("curses_items_added", self.on_items_added, self)
 
         # Upon creation, this Tag adds itself to the
         # list of all tags.
 
         alltags.append(self)
+        tags_by_name[self.tag] = self
 
         self.plugin_class = TagPlugin
         self.update_plugin_lookups()
@@ -116,8 +239,22 @@ class Tag(PluginHandler, list):
         for s in self:
             s.die()
         del self[:]
-
-        alltags.remove(self)
+        self.sync_places = {}
+        if self.sync_job:
+            self.sync_job.cancelled = True
+            self.sync_job = None
+        attr_dispatcher.remove_ids(self, list(self.id_index.keys()))
+        self.id_index = {}
+
+        render_cache.forget(self.render_cache)
+
+        # Tags compare by content, so remove by identity.
+        for i, t in enumerate(alltags):
+            if t is self:
+                del alltags[i]
+                break
+        if tags_by_name.get(self.tag) is self:
+            del tags_by_name[self.tag]
 
         unhook_all(self)
 
@@ -137,29 +274,37 @@ class Tag(PluginHandler, list):
         if "color" in opts or "style" in opts:
             self.need_redraw()
 
+        # Only pass on sections stories care about.
+
+        for key in [ "taglist", "color", "style", "story" ]:
+            if key in opts:
+                for s in self[:]:
+                    s.on_opt_change(opts)
+                story_hook_calls["curses_opt_change"] += len(self)
+                break
+
     def on_tag_opt_change(self, opts):
-        if self.tag in list(opts.keys()):
+        if self.tag in opts:
             tc = opts[self.tag]
+            self.opts.update(tc)
+
             if "collapsed" in tc:
                 self.need_refresh()
             else:
                 self.need_redraw()
 
-    # Technically, we might want to hold sync_lock so that self[:] doesn't
-    # change, but if we're syncing, the setting of needs_redraw isn't important
-    # anymore, and if we're not, there's no issue.
+    # Called by attr_dispatcher for each changed id we hold.
 
-    def on_attributes(self, attributes):
-        for s in self:
-            if s.id in attributes:
-                self.need_redraw()
-                break
+    def on_story_attributes(self, s_id, attributes):
+        story = self.id_index.get(s_id)
+        if story:
+            story.on_attributes(attributes)
+            self.need_redraw()
 
     def on_items_added(self, tagcore, added):
         if tagcore == self.tagcore:
-            cur_ids = self.get_ids()
             for story_id in added:
-                if story_id not in cur_ids:
+                if story_id not in self.id_index:
                     self.updates_pending += 1
             self.need_redraw()
 
@@ -175,62 +320,41 @@ class Tag(PluginHandler, list):
         return "%s" % self.tag[self.tag.index(':') + 1:]
 
     def get_id(self, id):
-        for item in self:
-            if item.id == id:
-                return item
+        return self.id_index.get(id)
 
     def get_ids(self):
         return [ s.id for s in self ]
 
-    # Inform the tag of global index of it's first item.
-    def set_item_offset(self, offset):
-        if self.item_offset != offset:
-            self.item_offset = offset
-            for i, item in enumerate(self):
-                item.set_offset(offset + i)
-
-    # Note that this cannot be short-cut (i.e.
-    # copout if sel_offset is already equal)
-    # because it's possible that it's the same
-    # without the items having ever been updated.
-
-    # Alternatively, we could reset them in
-    # on_tag_opt_change, but since the sel
-    # offset does not cause a redraw, there's
-    # no point.
-
-    def set_sel_offset(self, offset):
-        self.sel_offset = offset
-
-        if not self.callbacks["get_tag_opt"]("collapsed"):
-            for i, item in enumerate(self):
-                item.set_sel_offset(offset + i)
-
     def set_visible_tag_offset(self, offset):
-        if self.visible_tag_offset != offset:
-            self.visible_tag_offset = offset
-            self.need_redraw()
+        self.visible_tag_offset = offset
 
     def set_tag_offset(self, offset):
-        if self.tag_offset != offset:
-            self.tag_offset = offset
-            self.need_redraw()
+        self.tag_offset = offset
+
+    # Selection is drawn over our rendering by the TagList (see sel_spans), so
+    # it only needs the window redrawn.
 
     def select(self):
         if not self.selected:
             self.selected = True
-            self.need_redraw()
+            self.callbacks["set_var"]("needs_redraw", True)
 
     def unselect(self):
         if self.selected:
             self.selected = False
-            self.need_redraw()
+            self.callbacks["set_var"]("needs_redraw", True)
+
+    # A refresh is only needed when our stories, or whether they're shown,
+    # change, so that's what marks us dirty for the TagList.
 
     def need_refresh(self):
+        self.version += 1
         self.changed = True
+        self.display_dirty = True
         self.callbacks["set_var"]("needs_refresh", True)
 
     def need_redraw(self):
+        self.version += 1
         self.changed = True
         self.callbacks["set_var"]("needs_redraw", True)
 
@@ -243,9 +367,6 @@ class Tag(PluginHandler, list):
                 "read" not in s.content["canto-state"]])
 
         s = ""
-        if self.selected:
-            s += cc("selected")
-
         if self.collapsed:
             s += "[+]"
         else:
@@ -257,33 +378,39 @@ class Tag(PluginHandler, list):
         if self.updates_pending:
             s += " [" + cc("pending") + str(self.updates_pending) + cc.end("pending") + "]"
 
-        if self.selected:
-            s += cc.end("selected")
-
         return s
 
     def lines(self, width):
         if width == self.width and not self.changed:
             return self.lns
 
-        taglist_conf = self.callbacks["get_opt"]("taglist")
-
-        self.collapsed = self.callbacks["get_tag_opt"]("collapsed")
-        self.border = taglist_conf["border"]
-        self.enumerated = taglist_conf["tags_enumerated"]
-        self.abs_enumerated = taglist_conf["tags_enumerated_absolute"]
-
-        extra_tags = self.callbacks["get_tag_conf"](self.tag)['extra_tags']
+        self.collapsed = self.opts.collapsed
+        self.border = opt_border()
 
         self.pad = None
         self.footpad = None
         self.width = width
         self.changed = False
 
+        key = (width, self.version)
+        cached = render_cache.get(self.render_cache, key)
+        if cached:
+            self.buf, self.lns, self.sel_spans, self.footbuf, self.footlines =\
+                    cached
+            return self.lns
+
         self.evald_string = self.eval()
 
-        self.lns = self.render_header(width, FakePad(width))
-        self.footlines = self.render_footer(width, FakePad(width))
+        self.buf = LineBuffer(width)
+        self.lns = self.render_header(width, self.buf)
+
+        self.footbuf = LineBuffer(width)
+        self.footlines = self.render_footer(width, self.footbuf)
+
+        render_cache.put(self.render_cache, key,
+                (self.buf, self.lns, self.sel_spans, self.footbuf, self.footlines),
+                self.buf.size() + self.footbuf.size(),
+                lambda k : k[1] == self.version)
 
         return self.lns
 
@@ -292,34 +419,36 @@ class Tag(PluginHandler, list):
             return self.lns
 
         self.pad = curses.newpad(self.lines(width), width)
-        self.render_header(width, WrapPad(self.pad))
+        self.buf.blit(self.pad)
 
         if self.footlines:
             self.footpad = curses.newpad(self.footlines, width)
-            self.render_footer(width, WrapPad(self.footpad))
+            self.footbuf.blit(self.footpad)
         return self.lns
 
+    # The offset information the TagList draws over our first line.
+
+    def enum_header(self):
+        header = ""
+        if opt_tags_enumerated():
+            header += cc("enum_hints") + "[" + str(self.visible_tag_offset) + "]%0"
+        if opt_tags_enumerated_absolute():
+            header += cc("enum_hints") + "[" + str(self.tag_offset) + "]%0"
+        return header
+
     def render_header(self, width, pad):
         s = self.evald_string
         lines = 0
 
+        # The columns the header takes up on each line, to be highlighted
+        # when we're selected.
+
+        self.sel_spans = []
+
         try:
             while s:
                 s = theme_print(pad, s, width, "", "")
-
-                if lines == 0:
-                    header = ""
-                    if self.enumerated:
-                        header += cc("enum_hints") + "[" + str(self.visible_tag_offset) + "]%0"
-                    if self.abs_enumerated:
-                        header += cc("enum_hints") + "[" + str(self.tag_offset) + "]%0"
-                    if header:
-                        pad.move(0, 0)
-                        theme_print(pad, header, width, "", "", False, False)
-                        try:
-                            pad.move(1, 0)
-                        except:
-                            pass
+                self.sel_spans.append((lines, 0, width))
                 lines += 1
 
             if not self.collapsed and self.border:
@@ -343,90 +472,162 @@ class Tag(PluginHandler, list):
             return 1
         return 0
 
-    # Synchronize this Tag with its TagCore
-
-    def sync(self, force=False):
+    # Synchronize this Tag with its TagCore.
+    #
+    # The diff is done by the sync_worker, so a huge tag doesn't hold
+    # sync_lock for it. When the tagcore changes, sync() queues a SyncJob with
+    # our current ids. Once the worker has diffed them, the next sync() drops
+    # the stories that are gone, and then builds and appends the new stories a
+    # chunk at a time, until the deadline (a time.time() value) passes. In
+    # between, the Tag holds every story it kept plus the new ones appended so
+    # far, so it can be drawn and navigated as usual, and existing stories
+    # (including the selection) stay where they are while the rest fill in.
+    # Once the last chunk is in, the stories are put in their final order.
+    #
+    # Returns False while a job is unfinished.
+
+    def sync(self, force=False, deadline=None):
         if force or self.tagcore.changes:
-            sel = self.callbacks["get_var"]("selected")
+            self.queue_sync()
+
+        if self.sync_job:
+            self.apply_sync(deadline)
+
+        # The pending count is part of the header.
+        if self.updates_pending:
+            self.updates_pending = 0
+            self.need_redraw()
 
-            self.tagcore.lock.acquire_read()
+        return not self.sync_job
 
-            self.tagcore.ack_changes()
+    # Whether sync() can make progress right now, rather than waiting on the
+    # worker.
 
-            # Get sorted ids, along with their (unsorted) positions in the
-            # original lists.
+    def sync_ready(self):
+        return not self.sync_job or self.sync_job.ready()
 
-            sorted_ids = [ (x, x.id, i) for (i, x) in enumerate(self) ]
-            sorted_ids.sort(key=lambda x: x[1])
+    # A new job supersedes any unfinished one. What the old one merged is in
+    # our ids, and what it didn't will be new to this one.
 
-            tagcore_sorted_ids = list(enumerate(self.tagcore))
-            tagcore_sorted_ids.sort(key=lambda x: x[1])
+    def queue_sync(self):
+        self.tagcore.ack_changes()
 
-            new_ids = []
-            current_stories = []
-            old_stories = []
+        if self.sync_job:
+            self.sync_job.cancelled = True
 
-            for story, s_id, place in sorted_ids:
-                while tagcore_sorted_ids and s_id > tagcore_sorted_ids[0][1]:
-                    new_ids.append(tagcore_sorted_ids.pop(0))
+        self.sync_job = SyncJob(self, self.get_ids())
+        sync_worker.queue(self.sync_job)
 
-                if not tagcore_sorted_ids or s_id < tagcore_sorted_ids[0][1]:
-                    if sel and (not sel.is_tag) and (s_id == sel.id):
+    def apply_sync(self, deadline):
+        job = self.sync_job
 
-                        # If we preserve the selection in an "undead" state, then
-                        # we keep set tagcore changed so that the next sync operation
-                        # will re-evaluate it.
+        if not job.diff_applied:
+            diff = job.get_diff()
+            if diff == None:
+                return
+            self.apply_diff(diff)
+            job.diff_applied = True
 
-                        self.tagcore.changed()
-                        place = -1
-                        current_stories.append((place, story))
-                    else:
-                        old_stories.append(story)
-                else:
-                    place = tagcore_sorted_ids.pop(0)[0]
-                    current_stories.append((place, story))
+        new_stories = []
+        while True:
+            chunk = job.take()
+            if not chunk:
+                break
+
+            for place, s_id in chunk:
+                new_stories.append(Story(self, s_id, self.callbacks))
+                if self.sync_style == "maintain":
+                    self.sync_places[s_id] = place
+
+            if deadline and time.time() >= deadline:
+                break
+
+        if new_stories:
+            self.merge_stories(new_stories)
 
-            # Grab any remaining new items
-            new_ids += tagcore_sorted_ids
+        if job.finished():
+            if job.merged:
+                self.finish_sync()
+            self.sync_places = {}
 
-            self.tagcore.lock.release_read()
+            log.debug("tag %s synced", self.tag)
+            self.sync_job = None
 
-            new_stories = [ (p, Story(self, x, self.callbacks)) for (p, x) in new_ids ]
+    def apply_diff(self, diff):
+        new_ids, cur_ids, old_ids = diff
 
-            call_hook("curses_stories_added", [ self, [ x for (p, x) in new_stories ]])
+        sel = self.callbacks["get_var"]("selected")
 
-            del self[:]
+        current_stories = [ self[c_place] for (place, c_place, s_id) in cur_ids ]
+        places = [ place for (place, c_place, s_id) in cur_ids ]
+        old_stories = []
 
-            conf = config.get_conf()
-            if conf["update"]["style"] == "maintain" or self.tagcore.was_reset:
-                self.tagcore.was_reset = False
-                current_stories += new_stories
-                current_stories.sort()
-                self.extend([ x[1] for x in current_stories ])
+        for c_place, s_id in old_ids:
+            story = self[c_place]
+            if sel and (not sel.is_tag) and (s_id == sel.id):
+
+                # If we preserve the selection in an "undead" state, then
+                # we keep set tagcore changed so that the next sync operation
+                # will re-evaluate it.
+
+                self.tagcore.changed()
+                current_stories.insert(0, story)
+                places.insert(0, -1)
             else:
-                current_stories.sort()
-                new_stories.sort()
-                if conf["update"]["style"] == "append":
-                    current_stories += new_stories
-                    self.extend([ x[1] for x in current_stories ])
-                else:
-                    new_stories += current_stories
-                    self.extend([ x[1] for x in new_stories ])
+                old_stories.append(story)
 
-            for story in old_stories:
-                story.die()
+        style = config.get_opt("update.style")
+        if self.tagcore.was_reset:
+            self.tagcore.was_reset = False
+            style = "maintain"
 
-            # Properly dispose of the remaining stories
+        self.sync_style = style
+        self.sync_kept = len(current_stories)
+        if style == "maintain":
+            self.sync_places = dict(zip([ s.id for s in current_stories ], places))
 
-            call_hook("curses_stories_removed", [ self, old_stories ])
+        del self[:]
+        self.extend(current_stories)
 
-            # Trigger a refresh so that classes above (i.e. TagList) will remap
-            # items
+        removed_ids = []
+        for story in old_stories:
+            if self.id_index.get(story.id) is story:
+                del self.id_index[story.id]
+                removed_ids.append(story.id)
+            story.die()
+        attr_dispatcher.remove_ids(self, removed_ids)
 
-            self.need_refresh()
+        # Properly dispose of the remaining stories
 
-        # Pass the sync onto story objects
-        for s in self:
-            s.sync()
+        call_hook("curses_stories_removed", [ self, old_stories ])
 
-        self.updates_pending = 0
+        # Trigger a refresh so that classes above (i.e. TagList) will remap
+        # items
+
+        self.need_refresh()
+
+    # New stories are appended as they're built, so each chunk only costs its
+    # own length. finish_sync puts them in place once they're all in.
+
+    def merge_stories(self, new_stories):
+        call_hook("curses_stories_added", [ self, new_stories ])
+
+        self.extend(new_stories)
+
+        for story in new_stories:
+            self.id_index[story.id] = story
+        attr_dispatcher.add_ids(self, [ s.id for s in new_stories ])
+
+        self.need_refresh()
+
+    # The kept stories (and any undead selection first) are already in
+    # tagcore order, as are the new ones, so maintain sorts them together by
+    # place and prepend moves the new ones ahead.
+
+    def finish_sync(self):
+        if self.sync_style == "maintain":
+            self.sort(key=lambda s: self.sync_places[s.id])
+        elif self.sync_style == "prepend":
+            self[:] = self[self.sync_kept:] + self[:self.sync_kept]
+
+        self.need_refresh()
@@ -12,13 +12,37 @@ from canto_next.hooks import call_hook, on_hook
 from .subthread import SubThread
 from .locks import config_lock
 from .config import config, story_needed_attrs
+from .diff import diff_ids
 
+from collections import OrderedDict
 import traceback
 import logging
+import time
 
 log = logging.getLogger("TAGCORE")
 
+opt_attribute_cache = config.option("taglist.attribute_cache")
+
+# Seconds before need_attributes asks again for attributes it asked for but
+# never got.
+
+ATTR_PENDING_TIMEOUT = 10
+
+# Rough size, in bytes, of an attribute value as it came off the wire.
+
+def attr_size(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum([ len(k) + attr_size(v) for k, v in value.items() ])
+    if isinstance(value, (list, tuple)):
+        return sum([ attr_size(v) for v in value ])
+    return 8
+
+# Every TagCore, in creation order, and by name for lookups.
+
 alltagcores = []
+tagcores_by_name = {}
 
 class TagCore(list):
     def __init__(self, tag):
@@ -30,6 +54,7 @@ class TagCore(list):
 
         self.lock = RWLock("lock: %s" % tag)
         alltagcores.append(self)
+        tagcores_by_name[tag] = self
 
     # change functions must be called holding lock
 
@@ -52,19 +77,45 @@ class TagUpdater(SubThread):
     def init(self, backend):
         SubThread.init(self, backend)
 
-        self.updating = []
+        # Tag name -> number of ITEMS responses we're waiting on for an
+        # update.
+        self.updating = {}
 
         self.attributes = {}
         self.lock = RWLock("tagupdater")
 
+        # Story id -> (attributes, time) for ATTRIBUTES requests we haven't
+        # had a response to, so need_attributes doesn't ask twice.
+        # requests_saved counts the requests skipped because of it.
+
+        self.attr_pending = {}
+        self.requests_saved = 0
+
+        # Attributes in needed_attrs are always kept. Anything else (i.e.
+        # descriptions the reader pulled in) is cold: cold_lru tracks the
+        # size of each story's cold attributes, least recently used first,
+        # and once they're over taglist.attribute_cache KB the oldest are
+        # dropped. Whatever needs them again (the reader, fetch_visible)
+        # finds them missing and asks the daemon again.
+
+        self.cold_lru = OrderedDict()
+        self.cold_size = 0
+        self.cold_evicted = 0
+
         self.start_pthread()
 
         # Setup automatic attributes.
 
         # We know we're going to want at least these attributes for
-        # all stories, as they're part of the fallback format string.
+        # all stories, as they're part of the fallback format string, the
+        # unread counts, or changed by item commands.
+
+        self.needed_attrs = [ "title", "canto-state", "canto-tags" ]
+
+        # These are only fetched for stories that are on screen, or about to
+        # be (see fetch_visible).
 
-        self.needed_attrs = [ "title", "canto-state", "canto-tags", "link", "enclosures" ]
+        self.view_attrs = [ "link", "enclosures" ]
 
         tsa = config.get_opt("taglist.search_attributes")
 
@@ -82,11 +133,14 @@ class TagUpdater(SubThread):
 
         strtags = config.get_var("strtags")
 
-        # Request initial information, instantiate TagCores()
+        # Request initial information, instantiate TagCores(). We've already
+        # asked to watch all of strtags, so just pipeline the ITEMS requests
+        # instead of going through on_new_tag.
 
         self.write("WATCHTAGS", strtags)
         for tag in strtags:
-            self.on_new_tag(tag)
+            self.prot_tagchange(tag)
+            call_hook("curses_new_tagcore", [ TagCore(tag) ])
 
         on_hook("curses_new_tag", self.on_new_tag)
         on_hook("curses_del_tag", self.on_del_tag)
@@ -101,34 +155,42 @@ class TagUpdater(SubThread):
         call_hook("curses_new_tagcore", [ TagCore(tag) ])
 
     def on_del_tag(self, tag):
-        for tagcore in alltagcores[:]:
-            if tagcore.tag == tag:
-                if len(tagcore):
-                    call_hook("curses_items_removed", [ tagcore, tagcore ] )
-                    tagcore.set_items([])
-                call_hook("curses_del_tagcore", [ tagcore ])
-                alltagcores.remove(tagcore)
-                while tagcore in self.updating:
-                    self.updating.remove(tagcore)
-                return
+        tagcore = tagcores_by_name.get(tag)
+        if tagcore is None:
+            return
+
+        if len(tagcore):
+            call_hook("curses_items_removed", [ tagcore, tagcore ] )
+            tagcore.set_items([])
+        call_hook("curses_del_tagcore", [ tagcore ])
+
+        # TagCores compare by content, so remove by identity.
+        for i, tc in enumerate(alltagcores):
+            if tc is tagcore:
+                del alltagcores[i]
+                break
+        del tagcores_by_name[tag]
+
+        self.updating.pop(tag, None)
 
     # Once they've been removed from the GUI, their attributes can be forgotten
     def on_stories_removed(self, tag, items):
-        tagcore = None
-        for tc in alltagcores:
-            if tc.tag == tag.tag:
-                tagcore = tc
-                break
+        tagcore = tagcores_by_name.get(tag.tag)
+        if tagcore is not None:
+            current = set(tagcore)
         else:
             log.warn("Couldn't find tagcore for removed story tag %s" % tag.tag)
+            current = set()
 
         self.lock.acquire_write()
         for item in items:
-            if tagcore and item.id in tc:
+            if item.id in current:
                 log.debug("%s still in tagcore, not removing", item.id)
                 continue
             if item.id in self.attributes:
                 del self.attributes[item.id]
+            self.attr_pending.pop(item.id, None)
+            self._untrack_cold(item.id)
         self.lock.release_write()
 
     # Changes to global filters should force a full refresh.
@@ -139,9 +201,11 @@ class TagUpdater(SubThread):
             self.update()
 
     def prot_attributes(self, d):
-        # Update attributes, and then notify everyone to grab new content.
+        # Update attributes, and then notify everyone with just the ids that
+        # changed in this message.
         self.lock.acquire_write()
 
+        changed = {}
         for key in d.keys():
             if key in self.attributes:
 
@@ -153,58 +217,99 @@ class TagUpdater(SubThread):
                 self.attributes[key] = cp
             else:
                 self.attributes[key] = d[key]
+            changed[key] = self.attributes[key]
+            self.attr_pending.pop(key, None)
+            self._track_cold(key)
+
+        # Stories get the trimmed attributes like any other change, so they
+        # let go of the cold ones too.
+
+        changed.update(self._evict_cold())
         self.lock.release_write()
 
-        call_hook("curses_attributes", [ self.attributes ])
+        call_hook("curses_attributes", [ changed ])
 
-    def prot_items(self, updates):
-        # Daemon should now only return with one tag in an items response
+    # Call with self.lock held for writing.
 
-        tag = list(updates.keys())[0]
+    def _track_cold(self, s_id):
+        self._untrack_cold(s_id)
 
-        for have_tag in alltagcores:
-            if have_tag.tag == tag:
-                break
-        else:
-            return
+        attrs = self.attributes[s_id]
+        size = sum([ attr_size(v) for k, v in attrs.items()\
+                if k not in self.needed_attrs ])
 
-        sorted_updated_ids = list(enumerate(updates[tag]))
-        sorted_updated_ids.sort(key=lambda x : x[1])
+        if size:
+            self.cold_lru[s_id] = size
+            self.cold_size += size
 
-        sorted_current_ids = list(enumerate(have_tag))
-        sorted_current_ids.sort(key=lambda x : x[1])
+    def _untrack_cold(self, s_id):
+        if s_id in self.cold_lru:
+            self.cold_size -= self.cold_lru.pop(s_id)
 
-        new_ids = []
-        cur_ids = []
-        old_ids = []
+    # Drop the least recently used cold attributes until we're in budget,
+    # always keeping the newest. Returns the trimmed attributes.
 
-        for c_place, c_id in sorted_current_ids:
-            while sorted_updated_ids and c_id > sorted_updated_ids[0][1]:
-                new_ids.append(sorted_updated_ids.pop(0))
+    def _evict_cold(self):
+        limit = opt_attribute_cache() * 1024
+        trimmed = {}
 
-            if not sorted_updated_ids or c_id < sorted_updated_ids[0][1]:
-                old_ids.append(c_id)
-            else:
-                cur_ids.append(sorted_updated_ids.pop(0))
+        while self.cold_size > limit and len(self.cold_lru) > 1:
+            s_id, size = self.cold_lru.popitem(last = False)
+            self.cold_size -= size
+            self.cold_evicted += 1
+
+            attrs = self.attributes[s_id]
+            trimmed[s_id] = dict([ (k, v) for k, v in attrs.items()\
+                    if k in self.needed_attrs ])
+            self.attributes[s_id] = trimmed[s_id]
+
+        return trimmed
+
+    # Mark stories' cold attributes as recently used.
+
+    def touch(self, ids):
+        self.lock.acquire_write()
+        for s_id in ids:
+            if s_id in self.cold_lru:
+                self.cold_lru.move_to_end(s_id)
+        self.lock.release_write()
+
+    def cold_summary(self):
+        self.lock.acquire_read()
+        r = "%d stories, %d KB of %d KB, %d evicted" % (len(self.cold_lru),
+                self.cold_size // 1024, opt_attribute_cache(), self.cold_evicted)
+        self.lock.release_read()
+        return r
+
+    def prot_items(self, updates):
+        # Daemon should now only return with one tag in an items response
+
+        tag = list(updates.keys())[0]
+
+        have_tag = tagcores_by_name.get(tag)
+        if have_tag is None:
+            return
 
-        new_ids += sorted_updated_ids
+        new_ids, cur_ids, old_ids = diff_ids(have_tag, updates[tag])
 
-        all_ids = new_ids + cur_ids
-        all_ids.sort()
+        # Every updated id is either new or current, so the new contents are
+        # just the update.
 
-        have_tag.set_items([x[1] for x in all_ids])
+        have_tag.set_items(updates[tag])
 
         if new_ids:
             call_hook("curses_items_added", [ have_tag, [x[1] for x in new_ids] ] )
 
         if old_ids:
-            call_hook("curses_items_removed", [ have_tag, old_ids ] )
+            call_hook("curses_items_removed", [ have_tag, [x[1] for x in old_ids] ] )
 
-        if have_tag in self.updating:
+        if tag in self.updating:
             have_tag.was_reset = True
             call_hook("curses_tag_updated", [ have_tag ])
-            self.updating.remove(have_tag)
-            if self.updating == []:
+            self.updating[tag] -= 1
+            if not self.updating[tag]:
+                del self.updating[tag]
+            if not self.updating:
                 call_hook("curses_update_complete", [])
 
     def prot_itemsdone(self, tag):
@@ -222,7 +327,8 @@ class TagUpdater(SubThread):
             self.write("ITEMS", [ tag ])
 
     def reset(self):
-        self.updating += alltagcores
+        for tagcore in alltagcores:
+            self.updating[tagcore.tag] = self.updating.get(tagcore.tag, 0) + 1
         return True
 
     def transform(self, name, transform):
@@ -267,11 +373,64 @@ class TagUpdater(SubThread):
             self.needed_attrs = needed
             self.write("AUTOATTR", self.needed_attrs)
 
+        # Even if we didn't update this time, make sure we attempt to get this
+        # id's new needed attributes, unless they've already been asked for.
+        # Requests that go unanswered are retried after ATTR_PENDING_TIMEOUT.
+
+        now = time.time()
+
+        if id in self.attr_pending:
+            pending, when = self.attr_pending[id]
+            if now - when < ATTR_PENDING_TIMEOUT and\
+                    not [ a for a in needed if a not in pending ]:
+                self.requests_saved += 1
+                self.lock.release_write()
+                return
+
+        self.attr_pending[id] = (needed, now)
         self.lock.release_write()
 
-        # Even if we didn't update this time, make sure we attempt to get this
-        # id's new needed attributes.
+        # The writer batches these into multi-id ATTRIBUTES messages.
 
         self.write("ATTRIBUTES", { id : needed })
 
+    # Add attributes that are only needed to show stories.
+
+    def want_attributes(self, attrs):
+        self.lock.acquire_write()
+        new = [ a for a in attrs if a not in self.view_attrs ]
+        if new:
+            self.view_attrs = self.view_attrs + new
+        self.lock.release_write()
+
+    # Request view_attrs for the given stories (those in the TagList's
+    # window and read-ahead) that don't have them and haven't asked.
+
+    def fetch_visible(self, stories):
+        now = time.time()
+        requests = []
+
+        self.lock.acquire_write()
+        for story in stories:
+            have = self.attributes.get(story.id, {})
+            missing = [ a for a in self.view_attrs if a not in have ]
+            if not missing:
+                if story.id in self.cold_lru:
+                    self.cold_lru.move_to_end(story.id)
+                continue
+
+            if story.id in self.attr_pending:
+                pending, when = self.attr_pending[story.id]
+                if now - when < ATTR_PENDING_TIMEOUT and\
+                        not [ a for a in missing if a not in pending ]:
+                    self.requests_saved += 1
+                    continue
+
+            self.attr_pending[story.id] = (missing, now)
+            requests.append((story.id, missing))
+        self.lock.release_write()
+
+        for s_id, missing in requests:
+            self.write("ATTRIBUTES", { s_id : missing })
+
 tag_updater = TagUpdater()
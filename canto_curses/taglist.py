@@ -11,11 +11,16 @@ from canto_next.plugins import Plugin
 
 from .command import register_commands, register_arg_types, unregister_all, _int_range, _int_check, _string
 from .tagcore import tag_updater, alltagcores
+from .config import config
 from .locks import config_lock
 from .guibase import GuiBase
+from .theme import WrapPad, theme_attrs, theme_print, theme_reset
+from .color import cc
 from .reader import Reader
-from .tag import Tag, alltags
+from .tag import Tag, alltags, tags_by_name
+from .displaylist import DisplayList
 
+from threading import Lock
 import logging
 import curses
 import shlex
@@ -24,6 +29,13 @@ import re
 
 log = logging.getLogger("TAGLIST")
 
+# Precompiled option handles for the refresh / redraw paths.
+
+opt_hide_empty_tags = config.option("taglist.hide_empty_tags")
+opt_search_attributes = config.option("taglist.search_attributes")
+opt_cursor = config.option("taglist.cursor")
+opt_read_ahead = config.option("taglist.read_ahead")
+
 # TagList is the class renders a classical Canto list of tags into the given
 # panel. It defers to the Tag class for the actual individual tag rendering.
 # This is the level at which commands are taken and the backend is communicated
@@ -48,9 +60,28 @@ class TagList(GuiBase):
 
         self.first_sel = None
 
+        # Attributes for drawing the selection, from style.selected
+        self.sel_attrs = 0
+
         self.first_story = None
         self.last_story = None
 
+        # The visible objects, in order, with their line heights. Kept up to
+        # date by refresh().
+        self.display = DisplayList([])
+        self.refresh_touched = 0
+
+        # Objects drawn by the last redraw, to be moved offscreen by the next.
+        self.drawn = []
+
+        # Position of the first story drawn last time, to tell which way
+        # we're scrolling for read-ahead.
+        self.last_first_story = 0
+
+        # Ids of stories goto is waiting on links for (see cmd_goto).
+        self.goto_lock = Lock()
+        self.goto_pending = []
+
         self.tags = []
         self.spacing = callbacks["get_opt"]("taglist.spacing")
 
@@ -64,6 +95,7 @@ class TagList(GuiBase):
         on_hook("curses_stories_added", self.on_stories_added, self)
         on_hook("curses_stories_removed", self.on_stories_removed, self)
         on_hook("curses_opt_change", self.on_opt_change, self)
+        on_hook("curses_attributes", self.on_attributes, self)
         on_hook("curses_new_tagcore", self.on_new_tagcore, self)
         on_hook("curses_del_tagcore", self.on_del_tagcore, self)
 
@@ -278,9 +310,9 @@ class TagList(GuiBase):
 
     def on_del_tagcore(self, tagcore):
         log.debug("taglist on_del_tag")
-        for tagobj in alltags:
-            if tagobj.tag == tagcore.tag:
-                tagobj.die()
+        tagobj = tags_by_name.get(tagcore.tag)
+        if tagobj is not None:
+            tagobj.die()
 
         self.callbacks["set_var"]("needs_refresh", True)
 
@@ -314,6 +346,11 @@ class TagList(GuiBase):
         self.callbacks["set_var"]("needs_refresh", True)
 
     def on_opt_change(self, conf):
+        # Format attributes are fetched as stories come on screen.
+
+        if "story" in conf and "format_attrs" in conf["story"]:
+            tag_updater.want_attributes(conf["story"]["format_attrs"])
+
         if "taglist" not in conf:
             return
 
@@ -334,7 +371,52 @@ class TagList(GuiBase):
 
     def cmd_goto(self, items):
         log.debug("GOTO: %s", items)
-        self._goto([item.content["link"] for item in items])
+
+        # Links are only fetched near the screen, so items from elsewhere
+        # (i.e. marked) may not have them yet. We don't wait for those with
+        # sync_lock held, on_attributes opens them when they arrive.
+
+        links = []
+        missing = []
+
+        self.goto_lock.acquire()
+        for item in items:
+            link = item.content.get("link")
+            if link == None:
+                link = tag_updater.get_attributes(item.id).get("link")
+
+            if link == None:
+                if item.id not in self.goto_pending:
+                    self.goto_pending.append(item.id)
+                missing.append(item)
+            else:
+                links.append(link)
+        self.goto_lock.release()
+
+        if missing:
+            tag_updater.fetch_visible(missing)
+            log.info("Fetching %d links, they'll open when they arrive." % len(missing))
+
+        if links:
+            self._goto(links)
+
+    # Called from the TagUpdater thread with each batch of new attributes.
+
+    def on_attributes(self, attributes):
+        if not self.goto_pending:
+            return
+
+        links = []
+
+        self.goto_lock.acquire()
+        for s_id in self.goto_pending[:]:
+            if s_id in attributes and "link" in attributes[s_id]:
+                self.goto_pending.remove(s_id)
+                links.append(attributes[s_id]["link"])
+        self.goto_lock.release()
+
+        if links:
+            self._goto(links)
 
     def cmd_tag_state(self, state, tags):
         attributes = {}
@@ -388,65 +470,71 @@ class TagList(GuiBase):
                     else:
                         log.info(tag)
 
-    def _iterate_forward(self, start):
-        ns = start.next_sel
-        o = start
+    # Get an object's lines, keeping the display list's heights current.
+
+    def _lines(self, obj):
+        lines = obj.lines(self.width)
+        if obj in self.display:
+            self.display.set_height(obj, lines)
+        return lines
+
+    # Lines from the top of a to the top of b, negative if b is above a.
+    # Objects in between are measured until we're a screen away, past that the
+    # display list's heights are close enough, since the cursor will be put
+    # back on screen anyway.
+
+    def _distance(self, a, b):
+        if a not in self.display or b not in self.display:
+            return 0
+
+        sign = 1
+        if self.display.pos(b) < self.display.pos(a):
+            a, b = b, a
+            sign = -1
 
         lines = 0
+        while a and a is not b and lines <= self.height:
+            lines += self._lines(a)
+            a = self.display.next_obj(a)
 
-        # No next item, bail.
+        if a and a is not b:
+            lines += self.display.line(b) - self.display.line(a)
+        return sign * lines
 
-        if not ns:
-            return (None, lines)
+    def _iterate_forward(self, start):
+        ns = self.display.next_sel(start)
 
-        # Force changes to all objects between
-        # start and next sel.
+        # No next item, bail.
 
-        while o and o != ns:
-            lines += o.lines(self.width)
-            o = o.next_obj
+        if not ns:
+            return (None, 0)
 
-        return (ns, lines)
+        return (ns, self._distance(start, ns))
 
     def _iterate_backward(self, start):
-        ps = start.prev_sel
-        o = start
-
-        lines = 0
+        ps = self.display.prev_sel(start)
 
         # No prev item, bail.
 
         if not ps:
-            return (None, lines)
-
-        # Force changes to all objects between
-        # start and prev sel.
+            return (None, 0)
 
-        while o and o != ps:
-            o = o.prev_obj
-            lines += o.lines(self.width)
-
-        return (ps, lines)
+        return (ps, -self._distance(start, ps))
 
     def cmd_rel_set_cursor(self, relidx):
         sel = self.callbacks["get_var"]("selected")
-        if sel:
-            target_idx = sel.sel_offset + relidx
-            curpos = sel.curpos
+        count = self.display.sel_count()
+
+        if sel and sel in self.display and count:
+            target_idx = self.display.sel_pos(sel) + relidx
 
             if target_idx < 0:
                 target_idx = 0
+            elif target_idx >= count:
+                target_idx = count - 1
 
-            while sel.sel_offset != target_idx:
-                if target_idx < sel.sel_offset and sel.prev_sel:
-                    sel, lines = self._iterate_backward(sel)
-                    curpos -= lines
-                elif target_idx > sel.sel_offset and sel.next_sel:
-                    sel, lines = self._iterate_forward(sel)
-                    curpos += lines
-                else:
-                    break
-            self._set_cursor(sel, curpos)
+            target = self.display.sel(target_idx)
+            self._set_cursor(target, sel.curpos + self._distance(sel, target))
         else:
             self._set_cursor(self.first_sel, 0)
 
@@ -461,8 +549,7 @@ class TagList(GuiBase):
 
         if item:
 
-            conf = self.callbacks["get_conf"]()
-            curstyle = conf["taglist"]["cursor"]
+            curstyle = opt_cursor()
 
             # Convert window position for absolute positioning, edge
             # positioning uses given window_location.
@@ -535,17 +622,17 @@ class TagList(GuiBase):
         scroll = self.height - 1
 
         if sel:
-            while scroll > 0 and sel.prev_sel:
-                pstory = sel.prev_sel
+            while scroll > 0 and self.display.prev_sel(sel):
+                pstory = self.display.prev_sel(sel)
                 while sel != pstory:
-                    scroll -= sel.lines(self.width)
-                    sel = sel.prev_obj
+                    scroll -= self._lines(sel)
+                    sel = self.display.prev_obj(sel)
 
             self._set_cursor(sel, target_offset)
         else:
-            while scroll > 0 and target_obj.prev_obj:
-                target_obj = target_obj.prev_obj
-                scroll -= target_obj.lines(self.width)
+            while scroll > 0 and self.display.prev_obj(target_obj):
+                target_obj = self.display.prev_obj(target_obj)
+                scroll -= self._lines(target_obj)
 
             self.callbacks["set_var"]("target_obj", target_obj)
             self.callbacks["set_var"]("target_offset", target_offset)
@@ -563,22 +650,20 @@ class TagList(GuiBase):
         scroll = self.height - 1
 
         if sel:
-            while scroll > 0 and sel.next_sel:
-                if scroll < sel.lines(self.width):
+            while scroll > 0 and self.display.next_sel(sel):
+                if scroll < self._lines(sel):
                     break
 
-                nstory = sel.next_sel
-                while sel != nstory:
-                    scroll -= sel.lines(self.width)
-                    sel = sel.next_obj
+                sel, lines = self._iterate_forward(sel)
+                scroll -= lines
 
             self._set_cursor(sel, target_offset)
         else:
-            while scroll > 0 and target_obj.next_obj:
-                scroll -= target_obj.lines(self.width)
+            while scroll > 0 and self.display.next_obj(target_obj):
+                scroll -= self._lines(target_obj)
                 if scroll < 0:
                     break
-                target_obj = target_obj.next_obj
+                target_obj = self.display.next_obj(target_obj)
 
             self.callbacks["set_var"]("target_obj", target_obj)
             self.callbacks["set_var"]("target_offset", 0)
@@ -593,11 +678,18 @@ class TagList(GuiBase):
         target_offset = self.callbacks["get_var"]("target_offset")
 
         tag = self.tag_by_obj(sel)
+        if tag not in self.display:
+            return self._set_cursor(self.first_sel, 0)
 
-        while sel and self.tag_by_obj(sel) == tag:
-            if sel.next_sel == None:
-                break
-            sel = sel.next_sel
+        # The first selectable past the end of this tag's stories, if any.
+
+        idx = self.display.sel_after(tag)
+        count = self.display.sel_count()
+
+        if idx < count:
+            sel = self.display.sel(idx)
+        elif count:
+            sel = self.display.sel(count - 1)
 
         self._set_cursor(sel, target_offset)
 
@@ -611,17 +703,19 @@ class TagList(GuiBase):
 
         tag = self.tag_by_obj(sel)
 
-        while sel and self.tag_by_obj(sel) == tag:
-            if sel.prev_sel == None:
-                break
-            sel = sel.prev_sel
+        # The last selectable before this tag, if any, tells us which tag to
+        # go to. Otherwise, we go to the top of this one.
 
-        if sel:
-            newtag = self.tag_by_obj(sel)
-            if newtag.collapsed:
-                sel = newtag
-            else:
-                sel = newtag[0]
+        prev = self.display.prev_sel(tag)
+        if prev:
+            newtag = self.tag_by_obj(prev)
+        else:
+            newtag = tag
+
+        if newtag.collapsed:
+            sel = newtag
+        else:
+            sel = newtag[0]
 
         self._set_cursor(sel, target_offset)
 
@@ -702,7 +796,7 @@ class TagList(GuiBase):
 
     def cmd_toggle_collapse(self, tags):
         for tag in tags:
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
+            if tag.opts.collapsed:
                 self._uncollapse_tag(tag)
             else:
                 self._collapse_tag(tag)
@@ -714,10 +808,9 @@ class TagList(GuiBase):
             self.callbacks["set_var"]("error_msg", e)
             return
 
-        story = self.first_story
-        terms = self.callbacks["get_opt"]("taglist.search_attributes")
+        terms = opt_search_attributes()
 
-        while story:
+        for story in self.display.stories():
             for t in terms:
 
                 # Shouldn't happen unless a search happens before
@@ -732,8 +825,6 @@ class TagList(GuiBase):
             else:
                 story.unmark()
 
-            story = story.next_story
-
         self.callbacks["set_var"]("needs_redraw", True)
 
     def cmd_search(self, term):
@@ -752,71 +843,63 @@ class TagList(GuiBase):
             return
         return self.search(term)
 
-    def cmd_next_marked(self):
-        start = self.callbacks["get_var"]("selected")
+    # Search the stories for a marked one, starting from position first and
+    # stepping (wrapping) until we're back at start, where we stay if there
+    # isn't one. Only the cursor position needs lines, so nothing in between
+    # is rendered.
 
-        # This works for tags and stories alike.
-        if start:
-            cur = start.next_story
-        else:
-            start = self.first_story
-            cur = start
+    def _seek_marked(self, start, first, step):
+        count = self.display.story_count()
 
         # There's nothing to search
-        if not cur:
+        if not (0 <= first < count):
             return
 
-        curpos = cur.curpos
-
-        while not cur or not cur.marked:
-            # Wrap to top
-            if cur == None:
-                cur = self.first_story
-                curpos = self.first_story.curpos
-            else:
-                cur, lines = self._iterate_forward(cur)
-                curpos += lines
+        for i in range(count):
+            cur = self.display.story((first + i * step) % count)
+            if cur.marked:
+                break
 
-            # Make sure we don't infinite loop.
+            # Make sure we don't go past where we started.
             if cur == start:
-                if not cur.marked:
-                    self.callbacks["set_var"]\
-                            ("info_msg", "No marked items.")
                 break
+        else:
+            cur = start
 
-        self._set_cursor(cur, curpos)
+        if not cur.marked:
+            self.callbacks["set_var"]("info_msg", "No marked items.")
 
-    def cmd_prev_marked(self):
+        self._set_cursor(cur, start.curpos + self._distance(start, cur))
+
+    def cmd_next_marked(self):
         start = self.callbacks["get_var"]("selected")
 
         # This works for tags and stories alike.
-        if start:
-            cur = start.prev_story
+        if start in self.display:
+            first = self.display.story_pos(start)
+            if not start.is_tag:
+                first += 1
+        elif self.display.story_count():
+            start = self.display.story(0)
+            first = 0
         else:
-            start = self.last_story
-            cur = start
-
-        # There's nothing to search
-        if not cur:
             return
 
-        curpos = cur.curpos
+        self._seek_marked(start, first, 1)
 
-        while not cur or not cur.marked:
-            # Wrap to bottom
-            if cur == None:
-                cur = self.last_story
-                curpos = self.last_story.curpos
-            else:
-                cur, lines = self._iterate_backward(cur)
-                curpos -= lines
+    def cmd_prev_marked(self):
+        start = self.callbacks["get_var"]("selected")
 
-            # Make sure we don't infinite loop.
-            if cur == start:
-                self.callbacks["set_var"]("info_msg", "No marked items.")
-                break
+        # This works for tags and stories alike.
+        if start in self.display:
+            first = self.display.story_pos(start) - 1
+        elif self.display.story_count():
+            first = self.display.story_count() - 1
+            start = self.display.story(first)
+        else:
+            return
 
-        self._set_cursor(cur, curpos)
+        self._seek_marked(start, first, -1)
 
     def type_user_tag(self):
         utags = []
@@ -906,9 +989,15 @@ class TagList(GuiBase):
         # Make sure to honor the order of tags in curtags.
 
         for tag in curtags:
-            for tagobj in alltags:
-                if tagobj.tag == tag:
-                    self.tags.append(tagobj)
+            tagobj = tags_by_name.get(tag)
+            if tagobj is not None:
+                self.tags.append(tagobj)
+
+        # A tag is in self.tags if it's the registered Tag for a current name.
+
+        names = set(curtags)
+        def is_current(tagobj):
+            return tagobj.tag in names and tags_by_name.get(tagobj.tag) is tagobj
 
         # If selected is stale (i.e. its tag was deleted, the item should stick
         # around in all other cases) then unset it.
@@ -916,37 +1005,29 @@ class TagList(GuiBase):
         sel = self.callbacks["get_var"]("selected")
         tobj = self.callbacks["get_var"]("target_obj")
 
-        if sel and ((sel.is_tag and sel not in self.tags) or (not sel.is_tag and sel.is_dead)):
+        if sel and ((sel.is_tag and not is_current(sel)) or (not sel.is_tag and sel.is_dead)):
             log.debug("Stale selection")
             self.callbacks["set_var"]("selected", None)
 
-        if tobj and ((tobj.is_tag and tobj not in self.tags) or (not tobj.is_tag and tobj.is_dead)):
+        if tobj and ((tobj.is_tag and not is_current(tobj)) or (not tobj.is_tag and tobj.is_dead)):
             log.debug("Stale target obj")
             self.callbacks["set_var"]("target_obj", None)
             self.callbacks["set_var"]("target_offset", 0)
 
-        hide_empty = self.callbacks["get_opt"]("taglist.hide_empty_tags")
+        hide_empty = opt_hide_empty_tags()
 
-        cur_item_offset = 0
-        cur_sel_offset = 0
         t = []
 
+        # Story offsets come from the display list when they're drawn, so
+        # only the tags need theirs updated.
+
         for i, tag in enumerate(self.tags):
             if hide_empty and len(tag) == 0:
                 continue
 
-            # Update index info
-            tag.set_item_offset(cur_item_offset)
-            tag.set_sel_offset(cur_sel_offset)
             tag.set_tag_offset(i)
             tag.set_visible_tag_offset(len(t))
 
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
-                cur_sel_offset += 1
-            else:
-                cur_sel_offset += len(tag)
-                cur_item_offset += len(tag)
-
             t.append(tag)
 
         self.callbacks["set_var"]("taglist_visible_tags", t)
@@ -968,9 +1049,10 @@ class TagList(GuiBase):
             self.callbacks["set_var"]("target_obj", None)
             self.callbacks["set_var"]("target_offset", 0)
 
-    # Refresh updates information used to render the objects.
-    # Effectively, we build a doubly linked list out of all
-    # of the objects by setting obj.prev_obj and obj.next_obj.
+    # Refresh updates information used to render the objects. Effectively, we
+    # lay all of the visible objects out in a DisplayList. Only tags whose
+    # stories have changed since (see Tag.display_dirty) are laid out again,
+    # refresh_touched counts the objects that took.
 
     def refresh(self):
 
@@ -979,70 +1061,19 @@ class TagList(GuiBase):
         self.update_tag_lists()
         self.update_target_obj()
 
-        self.first_story = None
-
-        prev_obj = None
-        prev_story = None
-        prev_sel = None
-
-        for tag in self.callbacks["get_var"]("taglist_visible_tags"):
-            tag.curpos = self.height
-
-            tag.prev_obj = prev_obj
-            tag.next_obj = None
+        new_segs = self.display.set_tags(\
+                self.callbacks["get_var"]("taglist_visible_tags"))
 
-            tag.prev_story = prev_story
-            tag.next_story = None
+        self.refresh_touched = 0
+        for seg in new_segs:
+            for obj in seg.objs:
+                obj.curpos = self.height
+            self.refresh_touched += len(seg.objs)
 
-            tag.prev_sel = prev_sel
-            tag.next_sel = None
+        log.debug("Refresh touched %d objects", self.refresh_touched)
 
-            if prev_obj != None:
-                prev_obj.next_obj = tag
-
-            prev_obj = tag
-
-            # Collapsed tags (with items) skip stories.
-            if self.callbacks["get_tag_opt"](tag.tag, "collapsed"):
-                if prev_sel:
-                    prev_sel.next_sel = tag
-                prev_sel = tag
-                continue
-
-            for story in tag:
-                story.curpos = self.height
-
-                if not self.first_story:
-                    self.first_story = story
-
-                story.prev_obj = prev_obj
-                story.next_obj = None
-                prev_obj.next_obj = story
-                prev_obj = story
-
-                if prev_story != None:
-                    prev_story.next_story = story
-                story.prev_story = prev_story
-                story.next_story = None
-                prev_story = story
-
-                # We want next_story to be accessible from all objects, so head
-                # back and set it for any without one, even if it wasn't the
-                # last story object (i.e. if it's a tag)
-
-                cur = story.prev_obj
-                while cur and cur.next_story == None:
-                    cur.next_story = story
-                    cur = cur.prev_obj
-
-                if prev_sel != None:
-                    prev_sel.next_sel = story
-                story.prev_sel = prev_sel
-                story.next_sel = None
-                prev_sel = story
-
-                # Keep track of last story.
-                self.last_story = story
+        self.first_story = self.display.story(0)
+        self.last_story = self.display.story(self.display.story_count() - 1)
 
         self.callbacks["set_var"]("needs_redraw", True)
 
@@ -1076,6 +1107,32 @@ class TagList(GuiBase):
             if draw_lines:
                 pad.overwrite(self.pad, start, 0, main_offset, 0,
                         main_offset + (draw_lines - 1), self.width - 1)
+
+                # Selection is an overlay, so moving the cursor never
+                # re-renders the objects.
+
+                if obj.selected and not footer:
+                    for y, x0, x1 in obj.sel_spans:
+                        if start <= y < start + draw_lines:
+                            obj.buf.highlight(self.pad, y,
+                                    main_offset + (y - start), x0, x1,
+                                    self.sel_attrs)
+
+                # Same for enumeration, so a story's rendering never depends
+                # on its position.
+
+                if start == 0 and not footer:
+                    if not obj.is_tag:
+                        obj.set_offset(self.display.story_pos(obj))
+                        obj.set_rel_offset(self.display.rel_story_pos(obj))
+
+                    header = obj.enum_header()
+                    if header:
+                        self.pad.move(main_offset, 0)
+                        theme_print(WrapPad(self.pad), header, self.width,
+                                "", "", False, False)
+                        theme_reset()
+
                 return (main_offset + draw_lines, curpos + lines)
 
         return (main_offset, curpos + lines)
@@ -1126,9 +1183,10 @@ class TagList(GuiBase):
         top_adjusted = False
 
         while curpos > 0:
-            if obj.prev_obj:
-                curpos -= obj.prev_obj.lines(self.width)
-                obj = obj.prev_obj
+            prev_obj = self.display.prev_obj(obj)
+            if prev_obj:
+                curpos -= self._lines(prev_obj)
+                obj = prev_obj
 
             # If there aren't enough items to render before this item and
             # get to the top, adjust offset
@@ -1146,8 +1204,8 @@ class TagList(GuiBase):
 
         while last_off < (self.height - 1):
             if last_obj:
-                last_off += last_obj.lines(self.width)
-                last_obj = last_obj.next_obj
+                last_off += self._lines(last_obj)
+                last_obj = self.display.next_obj(last_obj)
 
             # Not enough items to render after our item,
             # adjust offset. Unfortunately, this means that
@@ -1175,27 +1233,35 @@ class TagList(GuiBase):
         self.first_sel = obj
         while self.first_sel.is_tag:
 
-            if self.callbacks["get_tag_opt"](obj.tag, "collapsed"):
+            if obj.opts.collapsed:
                 break
 
             # We use obj instead of sel here because next_sel will only be set
             # if the current object is selectable, which it isn't if it's not
             # collapsed.
 
-            if self.first_sel.next_obj:
-                self.first_sel = self.first_sel.next_obj
+            next_obj = self.display.next_obj(self.first_sel)
+            if next_obj:
+                self.first_sel = next_obj
             else:
                 break
 
         # Step 4. Render.
 
+        self.sel_attrs = theme_attrs(cc("selected"))
+
+        for drawn in self.drawn:
+            drawn.curpos = self.height
+        self.drawn = []
+
         rendered_header = False
         w_offset = 0
 
         while obj != None:
             # Refresh if necessary, update curpos for scrolling.
-            obj.lines(self.width)
+            self._lines(obj)
             obj.curpos = curpos
+            self.drawn.append(obj)
 
             # Copy item into window
             w_offset, curpos = self._partial_render(obj, w_offset, curpos)
@@ -1214,7 +1280,9 @@ class TagList(GuiBase):
 
             obj.extra_lines = 0
 
-            if (not obj.next_obj) or obj.next_obj.is_tag:
+            next_obj = self.display.next_obj(obj)
+
+            if (not next_obj) or next_obj.is_tag:
                 if obj.is_tag:
                     tag = obj
                 else:
@@ -1238,10 +1306,35 @@ class TagList(GuiBase):
             if w_offset >= self.height:
                 break
 
-            obj = obj.next_obj
+            obj = next_obj
+
+        self.fetch_visible()
 
         self.callbacks["refresh"]()
 
+    # Request the attributes that are only needed on screen (see
+    # TagUpdater.fetch_visible) for the stories drawn, plus taglist.read_ahead
+    # stories in the direction we're scrolling and a quarter of that behind.
+
+    def fetch_visible(self):
+        drawn = [ o for o in self.drawn if not o.is_tag and o in self.display ]
+        if not drawn:
+            return
+
+        first = self.display.story_pos(drawn[0])
+        last = self.display.story_pos(drawn[-1])
+
+        ahead = opt_read_ahead()
+        behind = ahead // 4
+        if first < self.last_first_story:
+            ahead, behind = behind, ahead
+        self.last_first_story = first
+
+        start = max(0, first - behind)
+        end = min(self.display.story_count(), last + ahead + 1)
+
+        tag_updater.fetch_visible([ self.display.story(i) for i in range(start, end) ])
+
     def is_input(self):
         return False
 
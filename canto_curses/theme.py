@@ -7,10 +7,13 @@
 #   published by the Free Software Foundation.
 
 from canto_next.encoding import encoder, locale_enc
-from .widecurse import waddch, wcwidth
+from .widecurse import waddch, waddnwstr, wcwidth, wcswidth
 from .html import html_entity_convert, char_ref_convert
 from .config import config
 
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
 import curses
 
 import logging
@@ -36,38 +39,338 @@ attr_map = { "B" : curses.A_BOLD,
 color_stack = []
 color_stack_suspended = []
 
-# Return length of next string of non-space characters
-# or 0 if next character *is* a space.
+# The effective, printed length of a string, taking escapes and wide characters
+# into account. This is what ThemeCompiled uses, everything else should use
+# theme_len() and get the cached value. Widths are the per-character widths
+# from wcswidth().
 
-def len_next_word(uni):
-    if ' ' in uni:
-        return theme_len(uni.split(' ', 1)[0])
-    return theme_len(uni)
+def _theme_len(uni, widths):
+    escaped = False
+    code = False
+    length = 0
+
+    for i, c in enumerate(uni):
+        ec = encoder(c)
+
+        cwidth = widths[i]
+        if cwidth < 0 and not ec.isspace():
+            continue
+
+        if escaped:
+            length += cwidth
+            escaped = False
+        elif code:
+            code = False
+        elif c == "\\":
+            escaped = True
+        elif c == "%":
+            code = True
+        else:
+            width = cwidth
+            if width >= 0:
+                length += width
+    return length
 
-class FakePad():
+# Theme strings are compiled once into a list of ops, so rendering doesn't
+# have to re-interpret the mini-language, or call encoder() and wcwidth(), for
+# every character of every render. The ops are:
+#
+#   (T_TEXT, start, text, widths, total, need, printable)
+#           a run of plain characters starting at uni[start], with their
+#           widths, the run's total width, the widest any prefix of it gets
+#           (the room needed to print it whole) and whether all of its
+#           characters have a non-negative width, so the run can be handed
+#           to the pad in one call.
+#   (T_SPACE, i, c, cwidth, wwidth)
+#           a plain space at uni[i] and the width of the word after it, that
+#           is the theme_len of everything up to the next ' ', escaped or not.
+#   (T_ESCAPED, i, c, cwidth)
+#           an escaped character at uni[i].
+#   (T_NEWLINE, i)
+#   (T_CODE, c)
+#           a %c attribute / color code.
+#   (T_LONG_CODE, lc)
+#           a %[lc] long color code, lc is None if it's unterminated.
+#
+# The source indices are kept so theme_print_one can return the unprinted
+# remainder as a slice of the original string. Text stays unencoded, pads
+# encode it on the way to widecurse.
+
+T_TEXT, T_SPACE, T_ESCAPED, T_NEWLINE, T_CODE, T_LONG_CODE = range(6)
+
+class ThemeCompiled(object):
+    def __init__(self, uni):
+        self.ops = []
+
+        # One call for all of the widths
+        widths = wcswidth(encoder(uni))[1]
+
+        self.length = _theme_len(uni, widths)
+
+        escaped = False
+        code = False
+
+        long_code = False
+        long_code_op = -1
+        lc = ""
+
+        run = None
+
+        # Word widths are measured in the same pass. The word after a plain
+        # space is only complete at the next ' ', so its T_SPACE op is filled
+        # in then.
+
+        word_width = 0
+        word_escaped = False
+        word_code = False
+        space_op = -1
+
+        for i, c in enumerate(uni):
+            ec = encoder(c)
+            cwidth = widths[i]
+            if cwidth < 0 and not ec.isspace():
+                # Runs have to be contiguous in the source.
+                run = self.end_run(run)
+                continue
+
+            if c == " ":
+                self.end_word(space_op, word_width)
+                space_op = -1
+                word_width = 0
+                word_escaped = False
+                word_code = False
+            elif word_escaped:
+                word_width += cwidth
+                word_escaped = False
+            elif word_code:
+                word_code = False
+            elif c == "\\":
+                word_escaped = True
+            elif c == "%":
+                word_code = True
+            elif cwidth >= 0:
+                word_width += cwidth
+
+            if not (escaped or code or long_code) and c not in "\\%\n ":
+                if not run:
+                    run = [ i, [], [] ]
+                run[1].append(c)
+                run[2].append(cwidth)
+                continue
+
+            run = self.end_run(run)
+
+            if escaped:
+                self.ops.append((T_ESCAPED, i, c, cwidth))
+                escaped = False
+            elif code:
+                if c == "[":
+                    long_code = True
+                    long_code_op = len(self.ops)
+                    self.ops.append((T_LONG_CODE, None))
+                else:
+                    self.ops.append((T_CODE, c))
+                code = False
+            elif long_code:
+                if c == "]":
+                    self.ops[long_code_op] = (T_LONG_CODE, lc)
+                    long_code = False
+                    lc = ""
+                else:
+                    lc += c
+            elif c == "\\":
+                escaped = True
+            elif c == "%":
+                code = True
+            elif c == "\n":
+                self.ops.append((T_NEWLINE, i))
+            else:
+                space_op = len(self.ops)
+                self.ops.append((T_SPACE, i, c, cwidth, 0))
+
+        self.end_run(run)
+        self.end_word(space_op, word_width)
+
+        # A trailing, incomplete code
+        self.dangling_code = code
+
+    def end_word(self, space_op, word_width):
+        if space_op >= 0:
+            self.ops[space_op] = self.ops[space_op][:4] + (word_width,)
+
+    def end_run(self, run):
+        if run:
+            start, chars, widths = run
+            total = 0
+            need = 0
+            for cwidth in widths:
+                total += cwidth
+                need = max(need, total)
+            self.ops.append((T_TEXT, start, "".join(chars), widths, total,
+                need, min(widths) >= 0))
+        return None
+
+# Compiled strings are kept in a bounded LRU, keyed by the source string.
+
+THEME_CACHE_SIZE = 1024
+
+theme_cache = OrderedDict()
+theme_cache_lock = Lock()
+
+def theme_compile(uni):
+    theme_cache_lock.acquire()
+    compiled = theme_cache.get(uni)
+    if compiled:
+        theme_cache.move_to_end(uni)
+    theme_cache_lock.release()
+
+    if compiled:
+        return compiled
+
+    compiled = ThemeCompiled(uni)
+
+    theme_cache_lock.acquire()
+    theme_cache[uni] = compiled
+    while len(theme_cache) > THEME_CACHE_SIZE:
+        theme_cache.popitem(last = False)
+    theme_cache_lock.release()
+
+    return compiled
+
+# LineBuffer is a pad that renders into a list of lines, each a list of
+# [x, attrs, text, widths, width] runs of characters with the same attributes.
+# Rendering into it once gives both the line count and the content, which can
+# be compared, kept, and blitted into a real curses pad.
+#
+# Attributes follow curses' rules: turning on a color replaces the current
+# color, turning one off clears it. Moving back over existing runs (like the
+# enumeration headers do) overwrites them.
+
+class LineBuffer(object):
     def __init__(self, width):
-        self.x = 0
-        self.y = 0
         self.width = width
+        self.lines = [ [] ]
+        self.attrs = 0
+        self.y = 0
+        self.x = 0
+
+    def __eq__(self, other):
+        return isinstance(other, LineBuffer) and\
+                self.width == other.width and self.lines == other.lines
 
     def attron(self, attr):
-        pass
+        if attr & curses.A_COLOR:
+            self.attrs = (self.attrs & ~curses.A_COLOR) | attr
+        else:
+            self.attrs |= attr
 
     def attroff(self, attr):
-        pass
+        if attr & curses.A_COLOR:
+            self.attrs &= ~(attr | curses.A_COLOR)
+        else:
+            self.attrs &= ~attr
+
+    def line(self, y):
+        while len(self.lines) <= y:
+            self.lines.append([])
+        return self.lines[y]
+
+    # Return the parts of line's runs that are entirely within [start, end)
+    # columns. Zero width characters go with the character before them.
+
+    def cut(self, line, start, end):
+        r = []
+        for run in line:
+            x, attrs, text, widths, width = run
+
+            if x >= start and x + width <= end:
+                r.append(run)
+                continue
+
+            if x + width <= start or x >= end:
+                continue
+
+            col = x
+            keep = start <= x < end
+            new_x = -1
+            new_text = ""
+            new_widths = []
+
+            for i, cwidth in enumerate(widths):
+                if cwidth > 0:
+                    keep = col >= start and col + cwidth <= end
+                if keep:
+                    if new_x < 0:
+                        new_x = col
+                    new_text += text[i]
+                    new_widths.append(cwidth)
+                col += cwidth
+
+            if new_text:
+                r.append([ new_x, attrs, new_text, new_widths, sum(new_widths) ])
+        return r
+
+    def put(self, text, widths, width):
+        line = self.line(self.y)
+        end = self.x + width
+
+        # Overwriting
+        if line and line[-1][0] + line[-1][4] > self.x:
+            line[:] = self.cut(line, 0, self.x) +\
+                    [[ self.x, self.attrs, text, widths[:], width ]] +\
+                    self.cut(line, end, max(end, self.width))
+
+        # Continuing the last run
+        elif line and line[-1][1] == self.attrs and\
+                line[-1][0] + line[-1][4] == self.x:
+            run = line[-1]
+            run[2] += text
+            run[3].extend(widths)
+            run[4] += width
+        else:
+            line.append([ self.x, self.attrs, text, widths[:], width ])
 
-    def clrtoeol(self):
-        pass
+        self.x = end
+        if self.x >= self.width:
+            self.y += 1
+            self.x -= self.width
 
     def waddch(self, ch):
-        cwidth = wcwidth(ch)
-        if cwidth < 0 and not ch.is_space():
+        cwidth = wcwidth(encoder(ch))
+
+        # Non-printables behave like they do with curses underneath the
+        # widecurse waddch, which always moves the cursor one column on.
+        # Tabs blank up to the next tab stop, or clear the rest of the line if
+        # that's past the edge, and newlines clear the rest of the line.
+
+        if cwidth < 0:
+            y, x = self.y, self.x
+            if ch == "\t":
+                tabstop = x + (8 - (x % 8))
+                if tabstop < self.width:
+                    self.put(" " * (tabstop - x), [ 1 ] * (tabstop - x), tabstop - x)
+                else:
+                    self.clrtoeol()
+            elif ch == "\n":
+                self.clrtoeol()
+            self.move(y, x + 1)
             return
 
-        self.x += cwidth
-        if self.x >= self.width:
-            self.y += 1
-            self.x -= self.width
+        self.put(ch, [ cwidth ], cwidth)
+
+    # Add a run of printable characters with the given widths.
+
+    def waddstr(self, text, widths, width):
+        if self.x + width <= self.width:
+            self.put(text, widths, width)
+            return
+
+        for i, cwidth in enumerate(widths):
+            self.put(text[i], [ cwidth ], cwidth)
+
+    def clrtoeol(self):
+        line = self.line(self.y)
+        line[:] = self.cut(line, 0, self.x)
 
     def getyx(self):
         return (self.y, self.x)
@@ -76,6 +379,130 @@ class FakePad():
         self.y = y
         self.x = x
 
+    # Draw into a curses pad, as much as fits.
+
+    def blit(self, pad):
+        height = pad.getmaxyx()[0]
+
+        for y, line in enumerate(self.lines[:height]):
+            for x, attrs, text, widths, width in line:
+                try:
+                    pad.move(y, x)
+                    pad.attrset(attrs)
+                    waddnwstr(pad, encoder(text), width)
+                except Exception as e:
+                    log.debug("Can't blit run: %s", repr(text))
+                    log.debug("Exception: %s", e)
+
+        pad.attrset(0)
+
+    # Re-attribute what was drawn in columns [x0, x1) of line y, now at row
+    # top of window, as if attr had been turned on when it was rendered. This
+    # is how selection is drawn without re-rendering.
+
+    def highlight(self, window, y, top, x0, x1, attr):
+        if y >= len(self.lines):
+            return
+
+        for x, attrs, text, widths, width in self.cut(self.lines[y], x0, x1):
+            if attr & curses.A_COLOR:
+                attrs = (attrs & ~curses.A_COLOR) | attr
+            else:
+                attrs |= attr
+
+            try:
+                window.chgat(top, x, width, attrs)
+            except Exception as e:
+                log.debug("Can't highlight run: %s", repr(text))
+                log.debug("Exception: %s", e)
+
+    # Rough size in bytes, for the render cache.
+
+    def size(self):
+        size = 64
+        for line in self.lines:
+            size += 64
+            for run in line:
+                size += 160 + 9 * len(run[2])
+        return size
+
+# The RenderCache keeps rendered LineBuffers (or anything else with a size),
+# so Story and Tag don't have to re-render when they flip back to a width or
+# state they've already rendered. Each owner keeps its own RenderEntries,
+# keyed however it likes, and the cache keeps them all in one LRU so that
+# their total size stays under taglist.render_cache KiB.
+
+opt_render_cache = config.option("taglist.render_cache")
+
+# A dict of one owner's entries. The LRU refers to it by serial, which unlike
+# id() is never handed out again after the owner is gone.
+
+render_serials = count()
+
+class RenderEntries(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self.serial = next(render_serials)
+
+class RenderCache(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.lru = OrderedDict()
+        self.size = 0
+
+    def get(self, entries, key):
+        self.lock.acquire()
+        r = entries.get(key)
+        if r:
+            self.lru.move_to_end((entries.serial, key))
+        self.lock.release()
+
+        if r:
+            return r[0]
+        return None
+
+    # Add an entry to an owner's dict. Entries failing keep(key) are dropped,
+    # so owners can shed entries that can't be hit anymore.
+
+    def put(self, entries, key, value, size, keep=None):
+        limit = opt_render_cache() * 1024
+        if size > limit:
+            return
+
+        self.lock.acquire()
+
+        if keep:
+            for old_key in list(entries.keys()):
+                if not keep(old_key):
+                    self._remove(entries, old_key)
+
+        if key in entries:
+            self._remove(entries, key)
+
+        entries[key] = (value, size)
+        self.lru[(entries.serial, key)] = entries
+        self.size += size
+
+        while self.size > limit:
+            (serial, old_key), old_entries = self.lru.popitem(last = False)
+            self.size -= old_entries.pop(old_key)[1]
+
+        self.lock.release()
+
+    # Drop all of an owner's entries, when it dies.
+
+    def forget(self, entries):
+        self.lock.acquire()
+        for key in list(entries.keys()):
+            self._remove(entries, key)
+        self.lock.release()
+
+    def _remove(self, entries, key):
+        del self.lru[(entries.serial, key)]
+        self.size -= entries.pop(key)[1]
+
+render_cache = RenderCache()
+
 class WrapPad():
     def __init__(self, pad):
         self.pad = pad
@@ -90,7 +517,10 @@ class WrapPad():
         self.pad.clrtoeol()
 
     def waddch(self, ch):
-        waddch(self.pad, ch)
+        waddch(self.pad, encoder(ch))
+
+    def waddstr(self, text, widths, width):
+        waddnwstr(self.pad, encoder(text), width)
 
     def getyx(self):
         return self.pad.getyx()
@@ -103,32 +533,80 @@ def theme_print_one(pad, uni, width):
     global attr_count
     global attr_map
 
+    compiled = theme_compile(uni)
+
     max_width = width
-    escaped = False
-    code = False
+    color_stack_suspended = []
 
-    long_code = False
-    lc = ""
+    for op in compiled.ops:
+        kind = op[0]
 
-    for i, c in enumerate(uni):
-        ec = encoder(c)
-        cwidth = wcwidth(ec)
-        if cwidth < 0 and not ec.isspace():
-            continue
+        if kind == T_TEXT:
+            start, text, widths, total, need, printable = op[1:]
+
+            # Whole run fits
+            if need <= width and printable:
+                try:
+                    pad.waddstr(text, widths, total)
+                except Exception as e:
+                    log.debug("Can't print run: %s in: %s", text, repr(encoder(uni)))
+                    log.debug("Exception: %s", e)
+                width -= total
+                continue
+
+            for j, c in enumerate(text):
+                cwidth = widths[j]
+
+                # Character too long
+                if cwidth > width:
+                    return uni[start + j:]
+
+                try:
+                    pad.waddch(c)
+                except Exception as e:
+                    log.debug("Can't print c: %s in: %s", c, repr(encoder(uni)))
+                    log.debug("Exception: %s", e)
+
+                width -= cwidth
+
+        elif kind == T_SPACE:
+            i, c, cwidth, wwidth = op[1:]
+
+            # Word too long, >= to account for current character
+            if wwidth <= max_width and wwidth >= width:
+                return uni[i + 1:]
+
+            if cwidth > width:
+                return uni[i:]
+
+            try:
+                pad.waddch(c)
+            except Exception as e:
+                log.debug("Can't print c: %s in: %s", c, repr(encoder(uni)))
+                log.debug("Exception: %s", e)
+
+            width -= cwidth
+
+        elif kind == T_ESCAPED:
+            i, c, cwidth = op[1:]
 
-        if escaped:
             # No room
             if cwidth > width:
                 return "\\" + uni[i:]
 
             try:
-                pad.waddch(ec)
+                pad.waddch(c)
             except:
-                log.debug("Can't print escaped ec: %s in: %s", ec, uni)
+                log.debug("Can't print escaped c: %s in: %s", c, uni)
 
             width -= cwidth
-            escaped = False
-        elif code:
+
+        elif kind == T_NEWLINE:
+            return uni[op[1] + 1:]
+
+        elif kind == T_CODE:
+            c = op[1]
+
             # Turn on color 1 - 8
             if c in "12345678":
                 if len(color_stack):
@@ -181,54 +659,27 @@ def theme_print_one(pad, uni, width):
                     pad.attron(curses.color_pair(color_stack[-1]))
                 else:
                     pad.attron(curses.color_pair(0))
-            elif c == "[":
-                long_code = True
-            code = False
-        elif long_code:
-            if c == "]":
-                try:
-                    long_color = int(lc)
-                except:
-                    log.error("Unknown long code: %s! Ignoring..." % lc)
-                else:
-                    if long_color < 1 or long_color > 256:
-                        log.error("long color code must be >= 1 and <= 256")
-                    else:
-                        try:
-                            pad.attron(curses.color_pair(long_color))
-                            color_stack.append(long_color)
-                        except:
-                            log.error("Could not set pair. Perhaps need to set TERM='xterm-256color'?")
-                long_code = False
-                lc = ""
-            else:
-                lc += c
-        elif c == "\\":
-            escaped = True
-        elif c == "%":
-            code = True
-        elif c == "\n":
-            return uni[i + 1:]
-        else:
-            if c == " ":
-                # Word too long
-                wwidth = len_next_word(uni[i + 1:])
 
-                # >= to account for current character
-                if wwidth <= max_width and wwidth >= width:
-                    return uni[i + 1:]
+        elif kind == T_LONG_CODE:
+            lc = op[1]
 
-            # Character too long (should be handled above).
-            if cwidth > width:
-                return uni[i:]
+            # Unterminated
+            if lc == None:
+                continue
 
             try:
-                pad.waddch(ec)
-            except Exception as e:
-                log.debug("Can't print ec: %s in: %s", ec, repr(encoder(uni)))
-                log.debug("Exception: %s", e)
-
-            width -= cwidth
+                long_color = int(lc)
+            except:
+                log.error("Unknown long code: %s! Ignoring..." % lc)
+            else:
+                if long_color < 1 or long_color > 256:
+                    log.error("long color code must be >= 1 and <= 256")
+                else:
+                    try:
+                        pad.attron(curses.color_pair(long_color))
+                        color_stack.append(long_color)
+                    except:
+                        log.error("Could not set pair. Perhaps need to set TERM='xterm-256color'?")
 
     return None
 
@@ -270,31 +721,53 @@ def theme_print(pad, uni, mwidth, pre = "", post = "", cursorbash=True, clear=Tr
 # escapes and wide characters into account.
 
 def theme_len(uni):
-    escaped = False
-    code = False
-    length = 0
+    return theme_compile(uni).length
 
-    for c in uni:
-        ec = encoder(c)
+# Returns the curses attributes a string of codes turns on, like the style
+# settings from cc(). This walks the codes with its own counts and color stack,
+# so it doesn't disturb a theme_print in progress. %C and %c are ignored.
 
-        cwidth = wcwidth(ec)
-        if cwidth < 0 and not ec.isspace():
-            continue
+def theme_attrs(uni):
+    counts = dict([ (attr, 0) for attr in attr_map ])
+    stack = []
 
-        if escaped:
-            length += cwidth
-            escaped = False
-        elif code:
-            code = False
-        elif c == "\\":
-            escaped = True
-        elif c == "%":
-            code = True
-        else:
-            width = cwidth
-            if width >= 0:
-                length += width
-    return length
+    buf = LineBuffer(1)
+
+    for op in theme_compile(uni).ops:
+        if op[0] == T_CODE:
+            c = op[1]
+
+            if c in "12345678":
+                stack.append(ord(c) - ord('0'))
+                buf.attron(curses.color_pair(stack[-1]))
+            elif c == '0':
+                if len(stack):
+                    buf.attroff(curses.color_pair(stack.pop()))
+                if len(stack):
+                    buf.attron(curses.color_pair(stack[-1]))
+            elif c in "BbDdRrSsUu":
+                if c.isupper():
+                    counts[c] += 1
+                else:
+                    c = c.upper()
+                    counts[c] -= 1
+
+                if counts[c]:
+                    buf.attron(attr_map[c])
+                else:
+                    buf.attroff(attr_map[c])
+
+        elif op[0] == T_LONG_CODE:
+            try:
+                long_color = int(op[1])
+            except:
+                continue
+
+            if 1 <= long_color <= 256:
+                stack.append(long_color)
+                buf.attron(curses.color_pair(long_color))
+
+    return buf.attrs
 
 # This is useful when a themed string needs to get truncated, so that color and
 # attribute settings can be processed, despite the last part of the string not
@@ -302,21 +775,16 @@ def theme_len(uni):
 
 def theme_process(pad, uni):
     only_codes = ""
-    escaped = False
-    code = False
 
-    for c in uni:
-        if escaped:
-            escaped = False
-            continue
-        elif code:
-            only_codes += c
-            code = False
-        elif c == "\\":
-            escaped = True
-        elif c == "%":
-            code = True
-            only_codes += "%"
+    compiled = theme_compile(uni)
+    for op in compiled.ops:
+        if op[0] == T_CODE:
+            only_codes += "%" + op[1]
+        elif op[0] == T_LONG_CODE:
+            only_codes += "%["
+
+    if compiled.dangling_code:
+        only_codes += "%"
 
     # NOTE: len works because codes never use widechars.
     theme_print(pad, only_codes, len(only_codes), "", "", False)
@@ -358,6 +826,8 @@ def theme_lstrip(pad, uni):
     return (newlines * "\n") + r
 
 def theme_reset():
+    global color_stack
+
     for key in attr_count:
         attr_count[key] = 0
     color_stack = []
@@ -6,6 +6,7 @@
    published by the Free Software Foundation.
 */
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <py_curses.h>
 #include <readline/readline.h>
@@ -78,6 +79,101 @@ static PyObject *py_waddch(PyObject * self, PyObject * args)
 	return ret_o;
 }
 
+/* Measure a whole string in one call. Like wcwidth, this takes the encoded
+ * string. Returns (width, widths) where widths is the wcwidth() of each
+ * character, -1 for bytes that don't decode, and width is the sum of the
+ * printable (non-negative) ones.
+ */
+
+static PyObject *py_wcswidth(PyObject * self, PyObject * args)
+{
+	PyObject *widths, *cw_o, *ret_o;
+	const char *message;
+	Py_ssize_t len, i;
+	wchar_t dest;
+	long total = 0;
+	int bytes, cw;
+
+	if (!PyArg_ParseTuple(args, "y#", &message, &len))
+		return NULL;
+
+	widths = PyList_New(0);
+	if (!widths)
+		return NULL;
+
+	mbtowc(NULL, NULL, 0);
+
+	for (i = 0; i < len; i += bytes) {
+		bytes = mbtowc(&dest, &message[i], len - i);
+		if (bytes <= 0) {
+			mbtowc(NULL, NULL, 0);
+			bytes = 1;
+			cw = -1;
+		} else
+			cw = wcwidth(dest);
+
+		if (cw > 0)
+			total += cw;
+
+		cw_o = PyLong_FromLong(cw);
+		if (!cw_o || PyList_Append(widths, cw_o) < 0) {
+			Py_XDECREF(cw_o);
+			Py_DECREF(widths);
+			return NULL;
+		}
+		Py_DECREF(cw_o);
+	}
+
+	ret_o = Py_BuildValue("(lN)", total, widths);
+	return ret_o;
+}
+
+/* Write a run of characters, all with the same attributes, in one call. Takes
+ * the encoded string, like waddch, and like waddch the cursor is left width
+ * columns after where it started. Bytes that don't decode are skipped.
+ */
+
+static PyObject *py_waddnwstr(PyObject * self, PyObject * args)
+{
+	PyObject *window;
+	WINDOW *win;
+	const char *message;
+	wchar_t *wstr;
+	Py_ssize_t len, i, wlen = 0;
+	int width, x, y, bytes;
+
+	if (!PyArg_ParseTuple(args, "Oy#i", &window, &message, &len, &width))
+		return NULL;
+
+	if (window == Py_None)
+		Py_RETURN_NONE;
+
+	win = ((PyCursesWindowObject *) window)->win;
+
+	wstr = PyMem_New(wchar_t, len + 1);
+	if (!wstr)
+		return PyErr_NoMemory();
+
+	mbtowc(NULL, NULL, 0);
+
+	for (i = 0; i < len; i += bytes) {
+		bytes = mbtowc(&wstr[wlen], &message[i], len - i);
+		if (bytes <= 0) {
+			mbtowc(NULL, NULL, 0);
+			bytes = 1;
+		} else
+			wlen++;
+	}
+	wstr[wlen] = 0;
+
+	getyx(win, y, x);
+	waddnwstr(win, wstr, wlen);
+	wmove(win, y, x + width);
+
+	PyMem_Free(wstr);
+	Py_RETURN_NONE;
+}
+
 static PyObject *py_wsize(PyObject * self, PyObject * args)
 {
 	return Py_BuildValue("i", sizeof(WINDOW));
@@ -215,6 +311,10 @@ static PyMethodDef WCMethods[] = {
 	{"waddch", (PyCFunction) py_waddch, METH_VARARGS, "waddch() wrapper."},
 	{"wcwidth", (PyCFunction) py_wcwidth, METH_VARARGS,
 	 "wcwidth() wrapper."},
+	{"wcswidth", (PyCFunction) py_wcswidth, METH_VARARGS,
+	 "Returns (width, per-character widths) of a string."},
+	{"waddnwstr", (PyCFunction) py_waddnwstr, METH_VARARGS,
+	 "waddnwstr() wrapper, for runs of characters."},
 	{"wsize", (PyCFunction) py_wsize, METH_VARARGS,
 	 "Returns sizeof(WINDOW)"},
 	{"set_redisplay_callback", (PyCFunction) py_set_redisplay_callback,
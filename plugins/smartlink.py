@@ -65,6 +65,7 @@ from canto_next.hooks import on_hook
 
 from canto_curses.taglist import TagListPlugin
 from canto_curses.reader import ReaderPlugin
+from canto_curses.tagcore import tag_updater
 from canto_curses.command import register_commands
 
 from threading import Thread
@@ -270,7 +271,13 @@ class TagListSmartLink(TagListPlugin):
         taglist.bind('f', 'fetch')
 
     def cmd_fetch_link(self, items):
-        SmartLinkThread(self.taglist, items[0].content["link"]).start()
+        link = items[0].content.get("link")
+        if link == None:
+            tag_updater.fetch_visible(items[:1])
+            log.info("Still fetching link, try again.")
+            return
+
+        SmartLinkThread(self.taglist, link).start()
         
 class ReaderSmartLink(ReaderPlugin):
     def __init__(self, reader):
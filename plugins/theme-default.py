@@ -38,14 +38,8 @@ class CantoThemeStoryDefault(StoryPlugin):
         if story.marked:
             s += cc("marked") + "[*]"
 
-        if story.selected:
-            s += cc("selected")
-
         s += prep_for_display(story.content["title"])
 
-        if story.selected:
-            s += cc.end("selected")
-
         if story.marked:
             s += cc.end("marked")
 
@@ -73,9 +67,6 @@ class CantoThemeTagDefault(TagPlugin):
 
         s = ""
 
-        if tag.selected:
-            s += cc("selected")
-
         if tag.collapsed:
             s += "[+]"
         else:
@@ -88,9 +79,6 @@ class CantoThemeTagDefault(TagPlugin):
         if tag.updates_pending:
             s += " [" + cc("pending") + str(tag.updates_pending) + cc.end("pending") + "]"
 
-        if tag.selected:
-            s += cc.end("selected")
-
         return s
 
 # Stolen from autocmd.py, but simple enough to copy instead of introducing a
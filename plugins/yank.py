@@ -9,6 +9,7 @@ from canto_next.plugins import check_program
 check_program("canto-curses")
 
 from canto_curses.taglist import TagListPlugin
+from canto_curses.tagcore import tag_updater
 from canto_curses.command import register_commands
 
 from subprocess import Popen, PIPE
@@ -35,7 +36,13 @@ class TagListYank(TagListPlugin):
         taglist.bind('Y', 'yank-title')
 
     def cmd_yank_link(self, items):
-        yank(items[0].content["link"])
+        link = items[0].content.get("link")
+        if link == None:
+            tag_updater.fetch_visible(items[:1])
+            log.info("Still fetching link, try again.")
+            return
+
+        yank(link)
 
     def cmd_yank_title(self, items):
         yank(items[0].content["title"])
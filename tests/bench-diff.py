@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark the id diff engine used by TagUpdater.prot_items and Tag.sync
+# against the old sorted list / pop(0) implementation on synthetic tags.
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from canto_curses.diff import diff_ids
+
+import random
+import time
+
+def old_diff(current, updated):
+    sorted_updated_ids = list(enumerate(updated))
+    sorted_updated_ids.sort(key=lambda x : x[1])
+
+    sorted_current_ids = list(enumerate(current))
+    sorted_current_ids.sort(key=lambda x : x[1])
+
+    new_ids = []
+    cur_ids = []
+    old_ids = []
+
+    for c_place, c_id in sorted_current_ids:
+        while sorted_updated_ids and c_id > sorted_updated_ids[0][1]:
+            new_ids.append(sorted_updated_ids.pop(0))
+
+        if not sorted_updated_ids or c_id < sorted_updated_ids[0][1]:
+            old_ids.append(c_id)
+        else:
+            cur_ids.append(sorted_updated_ids.pop(0))
+
+    new_ids += sorted_updated_ids
+
+    return (new_ids, cur_ids, old_ids)
+
+# Simulate an update: ~5% of stories expire, ~5% new stories show up at the
+# top, and the rest are reshuffled a bit.
+
+def synthetic(n):
+    current = [ "Story(%d)" % i for i in range(n) ]
+    updated = [ x for x in current if random.random() > 0.05 ]
+    updated = [ "New(%d)" % i for i in range(int(n / 20)) ] + updated
+    for i in range(int(n / 100)):
+        a = random.randrange(len(updated))
+        b = random.randrange(len(updated))
+        updated[a], updated[b] = updated[b], updated[a]
+    return (current, updated)
+
+def timed(f, *args):
+    start = time.time()
+    r = f(*args)
+    return (r, time.time() - start)
+
+def check(current, updated, new, old):
+    added, kept, removed = new
+    o_new, o_cur, o_old = old
+
+    if sorted(added) != sorted(o_new):
+        raise Exception("added mismatch")
+    if sorted([ (p, i) for (p, c, i) in kept ]) != sorted(o_cur):
+        raise Exception("kept mismatch")
+    if sorted([ i for (p, i) in removed ]) != sorted(o_old):
+        raise Exception("removed mismatch")
+
+    merged = sorted(added + [ (p, i) for (p, c, i) in kept ])
+    if [ i for (p, i) in merged ] != updated:
+        raise Exception("added + kept doesn't reproduce updated")
+
+if __name__ == "__main__":
+    random.seed(0)
+
+    for n in [ 1000, 10000, 100000 ]:
+        current, updated = synthetic(n)
+
+        new, new_t = timed(diff_ids, current, updated)
+        print("%6d ids: diff_ids %8.2fms" % (n, new_t * 1000), end="")
+
+        # The old implementation is quadratic, don't wait forever on it.
+        if n <= 10000:
+            old, old_t = timed(old_diff, current, updated)
+            check(current, updated, new, old)
+            print(" | old %8.2fms" % (old_t * 1000), end="")
+
+        print("")
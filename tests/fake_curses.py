@@ -59,6 +59,9 @@ class CursesPad():
     def attroff(self, attr):
         self.attrs ^= attr
 
+    def attrset(self, attr):
+        self.attrs = attr
+
     def clrtoeol(self):
         y = self.y
         while y == self.y:
@@ -86,6 +89,10 @@ class CursesPad():
             for j in range(cols):
                 dest_pad.pad[dminrow + i][dmincol + j] = self.pad[sminrow + i][smincol + j]
 
+    def chgat(self, y, x, num, attr):
+        for j in range(x, min(x + num, self.width)):
+            self.pad[y][j] = { "char" : self.pad[y][j]["char"], "attrs" : attr }
+
     def getyx(self):
         return (self.y, self.x)
 
@@ -3,6 +3,10 @@
 def waddch(pad, ch):
     pad.waddch(ch)
 
+def waddnwstr(pad, s, width):
+    for ch in s.decode("UTF-8"):
+        pad.waddch(ch)
+
 import sys
 
 self = sys.modules[__name__]
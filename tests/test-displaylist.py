@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from base import *
+
+from canto_curses.displaylist import LineIndex, DisplayList
+
+import random
+
+class FakeOpts(object):
+    def __init__(self, collapsed):
+        self.collapsed = collapsed
+
+class FakeTag(list):
+    def __init__(self, name, stories, collapsed=False):
+        list.__init__(self, [ FakeStory(name, i) for i in range(stories) ])
+        self.name = name
+        self.is_tag = True
+        self.opts = FakeOpts(collapsed)
+        self.display_dirty = True
+
+class FakeStory(object):
+    def __init__(self, tag, i):
+        self.name = "%s-%d" % (tag, i)
+        self.is_tag = False
+
+class TestDisplayList(Test):
+    def check(self):
+        # LineIndex against plain sums.
+
+        heights = [ random.randint(0, 5) for i in range(1000) ]
+        index = LineIndex(heights)
+
+        for i in range(500):
+            idx = random.randint(0, len(heights) - 1)
+            heights[idx] = random.randint(0, 5)
+            index.set(idx, heights[idx])
+
+        for idx in range(len(heights) + 1):
+            if index.line(idx) != sum(heights[:idx]):
+                raise Exception("Wrong line for %d" % idx)
+
+        for line in range(sum(heights)):
+            idx = index.find(line)
+            if not (sum(heights[:idx]) <= line < sum(heights[:idx + 1])):
+                raise Exception("Wrong entry for line %d: %d" % (line, idx))
+
+        if index.find(sum(heights) + 10) != len(heights) - 1:
+            raise Exception("find() didn't clamp")
+
+        # Navigation
+
+        tags = [ FakeTag("a", 3), FakeTag("b", 0), FakeTag("c", 2, True),
+                FakeTag("d", 2) ]
+        dl = DisplayList(tags)
+
+        names = [ o.name for o in dl.objs() ]
+        if names != [ "a", "a-0", "a-1", "a-2", "b", "c", "d", "d-0", "d-1" ]:
+            raise Exception("Unexpected order: %s" % names)
+
+        sels = [ dl.sel(i).name for i in range(dl.sel_count()) ]
+        if sels != [ "a-0", "a-1", "a-2", "c", "d-0", "d-1" ]:
+            raise Exception("Unexpected selectables: %s" % sels)
+
+        a, b, c, d = tags
+
+        if dl.next_sel(a[2]) is not c or dl.prev_sel(c) is not a[2]:
+            raise Exception("Wrong selectable neighbours")
+        if dl.next_sel(b) is not c or dl.next_sel(d[1]) != None:
+            raise Exception("Wrong selectable after tag / at end")
+        if dl.next_story(c) is not d[0] or dl.prev_story(d) is not a[2]:
+            raise Exception("Wrong story neighbours")
+        if dl.next_obj(a[2]) is not b or dl.prev_obj(a) != None:
+            raise Exception("Wrong object neighbours")
+        if dl.pos(d[1]) != 8 or dl.story(3) is not d[0]:
+            raise Exception("Wrong positions")
+
+        # Heights
+
+        dl.set_height(a, 2)
+        dl.set_height(d[0], 3)
+
+        if dl.line(d[1]) != 11 or dl.obj_at_line(10) is not d[0]:
+            raise Exception("Wrong lines after set_height")
+
+        # Replacing a tag's segment keeps known heights and moves everything
+        # after it.
+
+        a.insert(0, FakeStory("a", 3))
+        dl.update_tag(a)
+
+        if dl.pos(d[1]) != 9 or dl.line(d[1]) != 12:
+            raise Exception("Wrong positions after update_tag")
+        if dl.next_obj(a) is not a[0] or dl.prev_obj(a[1]) is not a[0]:
+            raise Exception("Wrong neighbours after update_tag")
+        if dl.sel_pos(c) != 4 or dl.story_pos(d) != 4:
+            raise Exception("Wrong counts after update_tag")
+
+        # Objects from elsewhere, or replaced, aren't in the list.
+
+        other = FakeTag("e", 1)
+        other[0].display_seg = d.display_seg
+        other[0].display_local = 1
+
+        if other[0] in dl or dl.next_obj(other[0]) != None:
+            raise Exception("Foreign object considered in list")
+
+        old = a[1]
+        a.remove(old)
+        dl.update_tag(a)
+
+        if old in dl:
+            raise Exception("Removed object considered in list")
+
+        # set_tags only lays out what's new or dirty, and keeps up with
+        # reordering.
+
+        dl = DisplayList([])
+        if len(dl.set_tags(tags)) != 4:
+            raise Exception("Expected every tag laid out")
+
+        d.append(FakeStory("d", 2))
+        d.display_dirty = True
+
+        new_segs = dl.set_tags([ d, c, b, a ])
+        if len(new_segs) != 1 or new_segs[0].tag is not d:
+            raise Exception("Expected only d laid out: %s" % new_segs)
+
+        names = [ o.name for o in dl.objs() ]
+        if names != [ "d", "d-0", "d-1", "d-2", "c", "b", "a", "a-3", "a-1",
+                "a-2" ]:
+            raise Exception("Unexpected order after set_tags: %s" % names)
+
+        if dl.story_pos(a[0]) != 3 or dl.next_sel(d[2]) is not c:
+            raise Exception("Wrong positions after set_tags")
+
+        return True
+
+TestDisplayList("display list")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+
+sys.modules['curses'] = __import__("fake_curses")
+
+import curses
+
+from base import *
+
+from canto_curses.theme import LineBuffer, theme_print, theme_reset
+
+# Records highlighting instead of drawing it.
+
+class ChgatPad(object):
+    def __init__(self):
+        self.calls = []
+
+    def chgat(self, y, x, num, attr):
+        self.calls.append((y, x, num, attr))
+
+class TestLineBuffer(Test):
+    def check(self):
+        bold = curses.A_BOLD
+        c2 = curses.color_pair(2)
+        c3 = curses.color_pair(3)
+
+        # Wrapping, attributes, and the right border moved into place.
+
+        buf = LineBuffer(12)
+        s = "%BHello%b %2wide world%0"
+        lines = 0
+        while s:
+            s = theme_print(buf, s, 12, "", "|")
+            lines += 1
+        theme_reset()
+
+        if lines != 2:
+            raise Exception("Expected 2 lines, got %d" % lines)
+
+        expected = [
+            [[ 0, bold, "Hello", [1] * 5, 5 ], [ 5, 0, " ", [1], 1 ],
+                [ 6, c2, "wide", [1] * 4, 4 ], [ 11, c2, "|", [1], 1 ]],
+            [[ 0, c2, "world", [1] * 5, 5 ], [ 11, 0, "|", [1], 1 ]],
+        ]
+
+        if buf.lines[:2] != expected:
+            raise Exception("Unexpected runs: %s" % buf.lines)
+
+        # Overwriting, like the enumeration headers do, splits runs.
+
+        buf = LineBuffer(12)
+        theme_print(buf, "abcdefgh", 12, "", "")
+        buf.move(0, 2)
+        theme_print(buf, "%3XY%0", 12, "", "", False, False)
+        theme_reset()
+
+        expected = [[ 0, 0, "ab", [1, 1], 2 ], [ 2, c3, "XY", [1, 1], 2 ],
+                [ 4, 0, "efgh", [1] * 4, 4 ]]
+
+        if buf.lines[0] != expected:
+            raise Exception("Unexpected overwrite: %s" % buf.lines[0])
+
+        # Identical renders compare equal.
+
+        a = LineBuffer(20)
+        b = LineBuffer(20)
+        theme_print(a, "%Bsame%b", 20, "", "")
+        theme_print(b, "%Bsame%b", 20, "", "")
+        theme_reset()
+
+        if a != b:
+            raise Exception("Identical renders differ")
+
+        # Escaped characters and spaces land in the same run as the text
+        # around them.
+
+        buf = LineBuffer(20)
+        theme_print(buf, "50\\% off", 20, "", "")
+        theme_reset()
+
+        expected = [[ 0, 0, "50% off", [1] * 7, 7 ]]
+
+        if buf.lines[0] != expected:
+            raise Exception("Unexpected escape: %s" % buf.lines[0])
+
+        # Highlighting re-attributes only what was drawn within the span,
+        # keeping the attributes underneath.
+
+        rev = curses.A_REVERSE
+
+        buf = LineBuffer(12)
+        theme_print(buf, "%BHello%b %2wide world%0", 12, "", "|")
+        theme_reset()
+
+        pad = ChgatPad()
+        buf.highlight(pad, 0, 0, 1, 11, rev)
+
+        expected = [ (0, 1, 4, bold | rev), (0, 5, 1, rev), (0, 6, 4, c2 | rev) ]
+
+        if pad.calls != expected:
+            raise Exception("Unexpected highlight: %s" % pad.calls)
+
+        return True
+
+TestLineBuffer("line buffer")
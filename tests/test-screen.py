@@ -121,7 +121,8 @@ class TestScreen(Test):
                 raise Exception("Story %s parent tag not in taglist.tags!")
 
         if recurse_attr:
-            self.check_taglist_obj(taglist, getattr(target_object, recurse_attr), recurse_attr)
+            follow = getattr(taglist.display, recurse_attr)
+            self.check_taglist_obj(taglist, follow(target_object), recurse_attr)
 
     def check_taglist_obj_links(self, taglist, target_object):
         self.check_taglist_obj(taglist, target_object, "next_obj")
@@ -151,12 +152,16 @@ class TestScreen(Test):
         return obj.id
 
     # Generate an easy to read summary of the taglist, following a certain
-    # attribute from a certain object so that large chains of items can be
-    # easily referenced by index instead of the linked list version that the
-    # taglist actually uses. Always starts with target_object / target_offset
-    # as these are integral to proper rendering.
+    # DisplayList method from a certain object so that large chains of items
+    # can be easily referenced by index. Always starts with target_object /
+    # target_offset as these are integral to proper rendering.
 
     def summarize_taglist(self, starting_object, follow_attr):
+        display = self.get_taglist().display
+        if not hasattr(display, follow_attr):
+            raise Exception("Couldn't find follow_attr %s" % follow_attr)
+        follow = getattr(display, follow_attr)
+
         target_object = self._summarize_object(config.vars["target_obj"])
         target_offset = config.vars["target_offset"]
 
@@ -168,10 +173,7 @@ class TestScreen(Test):
                 pos = starting_object.curpos
 
             rest.append((self._summarize_object(starting_object), pos))
-
-            if not hasattr(starting_object, follow_attr):
-                raise Exception("Couldn't find follow_attr %s" % follow_attr)
-            starting_object = getattr(starting_object, follow_attr)
+            starting_object = follow(starting_object)
 
         return [(target_object, target_offset)] + rest
 
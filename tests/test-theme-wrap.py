@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+
+sys.modules['curses'] = __import__("fake_curses")
+sys.modules['canto_curses.widecurse'] = __import__("fake_widecurse")
+
+import curses
+
+from base import *
+
+from canto_curses.theme import theme_print_one, theme_reset, prep_for_display
+from canto_curses.widecurse import wcwidth
+
+from canto_next.encoding import encoder
+
+# Feed content, as it comes out of real feeds, to be wrapped like the reader
+# wraps descriptions.
+
+corpus = [
+    "Canto is an Atom/RSS feed reader for the console that is meant to be quick, concise, and colorful. It's meant to allow you to crank through feeds like you've never cranked before by providing a minimal, yet information packed interface.",
+    "Linux 4.9 has been released on Sun, 11 Dec 2016. Summary: This release adds support for shared extents (aka reflinks) and copy-on-write support in XFS; support for virtually mapped kernel stacks; swap faster for SSDs; support for the BBR TCP congestion control algorithm; and more. http://kernelnewbies.org/Linux_4.9#head-0123456789abcdef0123456789abcdef",
+    "Open source\u00a0\u2014 \u201csome\u201d quotes, caf\u00e9s, na\u00efve co\u00f6peration and 100% of the \\backslashes\\ you'd expect.",
+    "\u65e5\u672c\u8a9e\u306e\u8a18\u4e8b\u3067\u3059\u3002 \u6f22\u5b57\u3068\u304b\u306a\u304c\u6df7\u3058\u3063\u305f \u9577\u3044\u6587\u7ae0\u304c \u6298\u308a\u8fd4\u3055\u308c\u308b\u304b \u78ba\u8a8d\u3057\u307e\u3059\u3002",
+    "Paragraph one.\n\nParagraph two, with  two  spaces   and\ttabs\tin it.\n \nA short last line.",
+    "averyveryveryveryveryveryveryveryveryveryveryveryveryveryveryveryveryverylongwordthatcannotfitonanyline followed by short words",
+    "   leading spaces and trailing spaces   ",
+    "",
+]
+
+# Themed strings, as the taglist and reader build them.
+
+themed = [
+    "%1%B" + prep_for_display(corpus[0]) + "%b%0",
+    "%[200]%B" + prep_for_display(corpus[1]) + "%b%0 %3more%0",
+    "%C%B\u2502%b %c" + prep_for_display(corpus[2]) + " %R[ 42 ]%r",
+    "%U%[12]" + prep_for_display(corpus[3]) + "%0%u",
+    "%D" + prep_for_display(corpus[4]) + "%d",
+]
+
+# The wrapping as it was before theme strings were compiled, re-slicing the
+# rest of the string at every space.
+
+def reference_len(uni):
+    escaped = False
+    code = False
+    length = 0
+
+    for c in uni:
+        ec = encoder(c)
+
+        cwidth = wcwidth(ec)
+        if cwidth < 0 and not ec.isspace():
+            continue
+
+        if escaped:
+            length += cwidth
+            escaped = False
+        elif code:
+            code = False
+        elif c == "\\":
+            escaped = True
+        elif c == "%":
+            code = True
+        elif cwidth >= 0:
+            length += cwidth
+    return length
+
+def reference_print_one(pad, uni, width):
+    max_width = width
+    escaped = False
+    code = False
+    long_code = False
+
+    for i, c in enumerate(uni):
+        ec = encoder(c)
+        cwidth = wcwidth(ec)
+        if cwidth < 0 and not ec.isspace():
+            continue
+
+        if escaped:
+            if cwidth > width:
+                return "\\" + uni[i:]
+            pad.waddch(c)
+            width -= cwidth
+            escaped = False
+        elif code:
+            if c == "[":
+                long_code = True
+            code = False
+        elif long_code:
+            if c == "]":
+                long_code = False
+        elif c == "\\":
+            escaped = True
+        elif c == "%":
+            code = True
+        elif c == "\n":
+            return uni[i + 1:]
+        else:
+            if c == " ":
+                rest = uni[i + 1:]
+                if ' ' in rest:
+                    rest = rest.split(' ', 1)[0]
+                wwidth = reference_len(rest)
+
+                if wwidth <= max_width and wwidth >= width:
+                    return uni[i + 1:]
+
+            if cwidth > width:
+                return uni[i:]
+
+            pad.waddch(c)
+            width -= cwidth
+
+    return None
+
+class RecordPad(object):
+    def __init__(self):
+        self.output = []
+
+    def attron(self, attr):
+        pass
+
+    def attroff(self, attr):
+        pass
+
+    def waddch(self, ch):
+        self.output.append(ch)
+
+    def waddstr(self, text, widths, width):
+        self.output.extend(text)
+
+def wrap(print_one, uni, width):
+    lines = []
+
+    while uni:
+        pad = RecordPad()
+        r = print_one(pad, uni, width)
+        lines.append(("".join(pad.output), r))
+        if r == uni:
+            break
+        uni = r
+
+    theme_reset()
+    return lines
+
+class TestThemeWrap(Test):
+    def check(self):
+        strings = [ prep_for_display(c) for c in corpus ] + themed
+
+        for s in strings:
+            for width in [ 1, 2, 5, 8, 13, 20, 40, 80, 132 ]:
+                got = wrap(theme_print_one, s, width)
+                expected = wrap(reference_print_one, s, width)
+
+                if got != expected:
+                    raise Exception("Wrap mismatch at width %d for %s:\n%s\n%s" %\
+                            (width, repr(s), got, expected))
+        return True
+
+TestThemeWrap("theme wrap")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from base import *
+
+from canto_curses.subthread import SubThread
+
+class Writer(SubThread):
+    pass
+
+class TestWriteQueue(Test):
+    def check(self):
+        backend = TestBackend("writer", {})
+
+        writer = Writer()
+        writer.init(backend)
+
+        # Adjacent mergeable requests go out as one, anything else stays in
+        # order between them. Hold the queue so the writer sees them all at
+        # once.
+
+        writer.write_cond.acquire()
+
+        writer.write("AUTOATTR", [ "title" ])
+        writer.write("AUTOATTR", [ "title", "link" ])
+        writer.write("ATTRIBUTES", { "id1" : [ "title" ] })
+        writer.write("ATTRIBUTES", { "id2" : [ "title" ] })
+        writer.write("ATTRIBUTES", { "id1" : [ "title", "link" ] })
+        writer.write("ITEMS", [ "maintag:Test" ])
+        writer.write("SETATTRIBUTES", { "id1" : { "canto-state" : [ "read" ] }})
+        writer.write("SETATTRIBUTES", { "id1" : { "canto-tags" : [] }})
+        writer.write("ATTRIBUTES", { "id3" : [ "title" ] })
+
+        writer.write_cond.release()
+
+        writer.flush_writes()
+
+        expected = [
+            ("AUTOATTR", [ "title", "link" ]),
+            ("ATTRIBUTES", { "id1" : [ "title", "link" ], "id2" : [ "title" ] }),
+            ("ITEMS", [ "maintag:Test" ]),
+            ("SETATTRIBUTES", { "id1" : { "canto-state" : [ "read" ], "canto-tags" : [] }}),
+            ("ATTRIBUTES", { "id3" : [ "title" ] }),
+        ]
+
+        if backend.output != expected:
+            raise Exception("Unexpected writes: %s" % backend.output)
+
+        stats = writer.write_stats
+        if stats.queued != 9 or stats.sent != 5 or stats.merged != 4:
+            raise Exception("Unexpected stats: %s" % stats.summary())
+
+        # Merged ATTRIBUTES are split into bounded batches.
+
+        backend.output = []
+
+        writer.write_cond.acquire()
+        for i in range(300):
+            writer.write("ATTRIBUTES", { "id%d" % i : [ "title" ] })
+        writer.write_cond.release()
+
+        writer.flush_writes()
+
+        sizes = [ len(args) for cmd, args in backend.output ]
+        if sizes != [ 256, 44 ]:
+            raise Exception("Unexpected batches: %s" % sizes)
+
+        return True
+
+TestWriteQueue("write queue")